@@ -1,13 +1,16 @@
 'Encode corpora and texts for the front end'
 
-from texts.models import MetaOrder
+from django.core.urlresolvers import reverse
+from texts.meta_config import meta_orders
 
 
 def _visualizations(obj):
 	return [{
-		"title":    v.visualization_format.title,
-		"slug":     v.visualization_format.slug,
-		"html":     v.html
+		"title":        v.visualization_format.title,
+		"slug":         v.visualization_format.slug,
+		"html":         v.html,
+		"html_url":     reverse('visualization', kwargs={'vis_id': v.id}),
+		"stylesheet":   reverse('stylesheet', kwargs={'fingerprint': v.stylesheet.fingerprint}) if v.stylesheet else None
 	} for v in obj.html_visualizations.all()]
 
 
@@ -20,7 +23,7 @@ def _vis_formats(obj):
 
 
 def _text_meta(text):
-	meta_orders_by_name = {mo.name: mo.order for mo in MetaOrder.objects.all()}
+	meta_orders_by_name = meta_orders()
 
 	def order(name):
 		return meta_orders_by_name.get(name) or 1000000
@@ -1,7 +1,126 @@
+import datetime
+import json
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from texts import meta_config
+from texts.models import Corpus, Text, TextMeta, HtmlVisualization, HtmlVisualizationFormat, VisualizationStylesheet
+
+def create_corpus(slug):
+	'Create a corpus with a visualization format. Corpus.save looks up the corpus on GitHub.'
+	now = datetime.datetime.today()
+	Corpus.objects.bulk_create([Corpus(created=now, modified=now, title=slug, slug=slug,
+		urn_code='urn:cts:copticLit:' + slug, annis_corpus_name=slug + '.corpus', github='')])
+	corpus = Corpus.objects.get(slug=slug)
+	corpus.html_visualization_formats.add(HtmlVisualizationFormat.objects.create(title='Norm', button_title='Norm', slug='norm'))
+	return corpus
+
+def add_text(corpus, title, order=None):
+	'Add a text with metadata and a visualization in each format of the corpus'
+	text = Text.objects.create(title=title, slug=title, corpus=corpus,
+		order_key=Text.make_order_key(title, [order] if order else []))
+	metas = [('document_cts_urn', '%s:%s' % (corpus.urn_code, title)), ('author', 'Shenoute')]
+	if order:
+		metas.append(('order', order))
+	text.text_meta.add(*[TextMeta.objects.get_or_create(name=name, value=value)[0] for name, value in metas])
+
+	for vis_format in corpus.html_visualization_formats.all():
+		stylesheet = VisualizationStylesheet.objects.get_or_create(visualization_format=vis_format,
+			fingerprint=VisualizationStylesheet.fingerprint_css('.norm{}'), defaults={'css': '.norm{}'})[0]
+		vis = HtmlVisualization(visualization_format=vis_format, stylesheet=stylesheet)
+		vis.html = '<div class="norm">%s</div>' % title
+		vis.save()
+		text.html_visualizations.add(vis)
+	return text
 
 class ApiViewsTestCase(TestCase):
 	def test_api_view(self):
 		print(" -- testing API views")
 		resp = self.client.get("/api/")
-		self.assertEqual(resp.status_code, 200)
\ No newline at end of file
+		self.assertEqual(resp.status_code, 200)
+
+	def test_corpus_texts_in_order(self):
+		print(" -- testing the order of the texts of corpora")
+		corpus = create_corpus('test')
+
+		def corpus_listing():
+			with CaptureQueriesContext(connection) as queries:
+				resp = self.client.get("/api/", {'model': 'corpus'})
+			titles = [text['title'] for text in json.loads(resp.content.decode())['corpus'][0]['texts']]
+			return titles, len(queries)
+
+		for title, order in [('c', '01'), ('a', '02'), ('b', None)]:
+			add_text(corpus, title, order)
+		titles, num_queries = corpus_listing()
+		self.assertEqual(titles, ['c', 'a', 'b'])
+
+		for title, order in [('d', None), ('e', '03')]:
+			add_text(corpus, title, order)
+		titles, more_texts_num_queries = corpus_listing()
+		self.assertEqual(titles, ['c', 'a', 'e', 'b', 'd'])
+		self.assertEqual(more_texts_num_queries, num_queries)
+
+# The cache the site is deployed with, whose reads are database queries
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'django_cache'}})
+class ApiQueryCountTestCase(TestCase):
+	'Each API mode runs a fixed number of queries, however many corpora, texts and visualizations it encodes'
+
+	@classmethod
+	def setUpClass(cls):
+		super(ApiQueryCountTestCase, cls).setUpClass()
+		call_command('createcachetable')
+
+	def setUp(self):
+		self.corpora = [create_corpus('first'), create_corpus('second')]
+		for corpus in self.corpora:
+			add_text(corpus, corpus.slug + '1')
+		meta_config.special_metas()  # Loaded once per process, not per request
+
+	def assertQueries(self, num, params):
+		'Assert the number of queries of the API request, before and after more texts are added'
+		with self.assertNumQueries(num):
+			self.assertEqual(self.client.get("/api/", params).status_code, 200)
+		for corpus in self.corpora:
+			for i in range(2, 5):
+				add_text(corpus, corpus.slug + str(i))
+		with self.assertNumQueries(num):
+			self.assertEqual(self.client.get("/api/", params).status_code, 200)
+
+	def test_corpus_queries(self):
+		print(" -- testing the queries of corpus listings")
+		# Corpora, their formats, and their texts
+		self.assertQueries(3, {'model': 'corpus'})
+
+	def test_corpus_slug_queries(self):
+		self.assertQueries(3, {'model': 'corpus', 'corpus_slug': 'first'})
+
+	def test_corpus_filter_queries(self):
+		# The texts matching the filter, corpora, their formats, and their texts
+		self.assertQueries(4, {'model': 'corpus', 'filters': json.dumps({'field': 'author', 'filter': 'Shenoute'})})
+
+	def test_urn_queries(self):
+		# The texts matching the URN, their corpora, the corpora's formats, and the texts in order
+		self.assertQueries(4, {'model': 'urn', 'urn_value': 'urn:cts:copticLit:first'})
+
+	def test_text_queries(self):
+		print(" -- testing the queries of a text")
+		# Corpus, text with its corpus, visualizations with their formats and stylesheets, metadata, and corpus formats
+		self.assertQueries(5, {'model': 'texts', 'corpus_slug': 'first', 'text_slug': 'first1'})
+
+class VisualizationViewTestCase(TestCase):
+	def test_visualization_encodings(self):
+		print(" -- testing the encodings of a visualization")
+		text = add_text(create_corpus('test'), 'test1')
+		url = "/api/visualizations/%d.html" % text.html_visualizations.get().id
+
+		gzipped = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+		self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+		identity = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0, deflate')
+		self.assertFalse(identity.has_header('Content-Encoding'))
+		self.assertEqual(identity.content.decode(), '<div class="norm">test1</div>')
+		self.assertNotEqual(gzipped['ETag'], identity['ETag'])
+
+		not_modified = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=gzipped['ETag'])
+		self.assertEqual(not_modified.status_code, 304)
+		self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=gzipped['ETag']).status_code, 200)
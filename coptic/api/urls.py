@@ -2,5 +2,7 @@ from django.conf.urls import patterns, url
 from api import views 
 
 urlpatterns = patterns('',
+   url(r'^visualizations/(?P<vis_id>\d+)\.html$', views.visualization, name='visualization'),
+   url(r'^stylesheets/(?P<fingerprint>[0-9a-f]{40})\.css$', views.stylesheet, name='stylesheet'),
    url(r'^(?P<params>.*)$', views.api, name='api'),
 )
\ No newline at end of file
@@ -1,12 +1,23 @@
 import logging
 import json
+from django.db.models import Prefetch
+from django.http import HttpResponse, Http404
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import etag
 from api.json import json_view
 from api.encoder import encode_corpus, encode_text
-from texts.models import Text, Corpus, TextMeta, SpecialMeta
+from texts.meta_config import special_metas
+from texts.models import Text, Corpus, TextMeta, VisualizationStylesheet, HtmlVisualization
 import functools
 
 log = logging.getLogger(__name__)
-TEXT_PREFETCH_FIELDS = 'html_visualizations'
+# Everything the encoder reads, so that each API mode runs the same number of queries however many objects it encodes
+CORPUS_PREFETCH_FIELDS = ('html_visualization_formats',)
+TEXT_PREFETCH_FIELDS = (
+    Prefetch('html_visualizations', queryset=HtmlVisualization.objects.select_related('visualization_format', 'stylesheet')),
+    'text_meta',
+    'corpus__html_visualization_formats')
+STYLESHEET_MAX_AGE = 365 * 24 * 60 * 60  # A stylesheet's URL changes with its content
 ALLOWED_MODELS = ('texts', 'corpus', 'urn')
 
 
@@ -32,7 +43,7 @@ def _query(params):
         elif model == 'corpus':
             if 'filters' in params:
                 corpus_ids, text_ids = _corpus_and_text_ids_from_filters(params['filters'])
-                corpora = Corpus.objects.filter(id__in=set(corpus_ids))
+                corpora = Corpus.objects.filter(id__in=set(corpus_ids)).prefetch_related(*CORPUS_PREFETCH_FIELDS)
 
                 if text_ids:
                     _add_texts_to_corpora(corpora, text_ids)
@@ -41,9 +52,9 @@ def _query(params):
 
             else:  # There are no filters. Check for specific corpus.
                 if 'corpus' in params and 'slug' in params['corpus']:
-                    corpora = Corpus.objects.filter(slug=params['corpus']['slug'])
+                    corpora = Corpus.objects.filter(slug=params['corpus']['slug']).prefetch_related(*CORPUS_PREFETCH_FIELDS)
                 else:
-                    corpora = Corpus.objects.all()
+                    corpora = Corpus.objects.prefetch_related(*CORPUS_PREFETCH_FIELDS)
 
                 _add_texts_to_corpora(corpora)
 
@@ -55,7 +66,7 @@ def _query(params):
             if 'corpus' in params and 'slug' in params['corpus'] and \
                'text'   in params and 'slug' in params['text']:
                 corpus = Corpus.objects.get(slug=params['corpus']['slug'])
-                text = Text.objects.filter(slug=params['text']['slug'], corpus=corpus.id).prefetch_related(TEXT_PREFETCH_FIELDS).first()
+                text = Text.objects.live().filter(slug=params['text']['slug'], corpus=corpus.id).select_related('corpus').prefetch_related(*TEXT_PREFETCH_FIELDS).first()
             else:
                 objects['error'] = 'No Text Query specified--missing corpus slug or text slug'
                 return objects
@@ -70,12 +81,65 @@ def _query(params):
     return objects
 
 
+@etag(lambda request, fingerprint: fingerprint)
+def stylesheet(request, fingerprint):
+    'Serve the CSS of visualizations, which is the same for all visualizations with the fingerprint'
+    stylesheet = VisualizationStylesheet.objects.filter(fingerprint=fingerprint).first()
+    if not stylesheet:
+        raise Http404('No stylesheet %s' % fingerprint)
+
+    response = HttpResponse(stylesheet.css, content_type='text/css; charset=utf-8')
+    response['Cache-Control'] = 'public, max-age=%d' % STYLESHEET_MAX_AGE
+    return response
+
+
+def _visualization_etag(request, vis_id):
+    'The fingerprint of the visualization, made different for the gzip-compressed response'
+    fingerprint = HtmlVisualization.objects.filter(id=vis_id).values_list('fingerprint', flat=True).first()
+    if not fingerprint:
+        return None
+    return fingerprint + '-gzip' if accepts_gzip(request) else fingerprint
+
+
+@etag(_visualization_etag)
+def visualization(request, vis_id):
+    'Serve the HTML of a visualization. Clients that accept gzip get the stored bytes as they are.'
+    vis = HtmlVisualization.objects.filter(id=vis_id).first()
+    if not vis:
+        raise Http404('No visualization %s' % vis_id)
+
+    if accepts_gzip(request):
+        response = HttpResponse(bytes(vis.html_gz), content_type='text/html; charset=utf-8')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(vis.html, content_type='text/html; charset=utf-8')
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def accepts_gzip(request):
+    'Whether the Accept-Encoding header gives gzip, or else *, a q-value above 0'
+    q_values = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        q_values[name.strip().lower()] = q
+    return q_values.get('gzip', q_values.get('*', 0.0)) > 0
+
+
 def _process_urn_request(urn, objects):
     texts = texts_for_urn(urn)
 
     # Find the corpora containing the matching texts
     corpus_ids = set([text.corpus_id for text in texts])
-    corpora = Corpus.objects.filter(id__in=corpus_ids)
+    corpora = Corpus.objects.filter(id__in=corpus_ids).prefetch_related(*CORPUS_PREFETCH_FIELDS)
 
     _add_texts_to_corpora(corpora, texts=texts)
     objects['corpus'] = _json_from_corpora(corpora)
@@ -85,34 +149,25 @@ def texts_for_urn(urn):
     # Find texts matching the URN using their metadata
     matching_tm_ids = TextMeta.objects.filter(name='document_cts_urn', value__iregex='^' + urn + r'($|[\.:])'
     	).values_list('id', flat=True)
-    texts = Text.objects.filter(text_meta__name='document_cts_urn',
+    texts = Text.objects.live().filter(text_meta__name='document_cts_urn',
         text_meta__id__in=matching_tm_ids).order_by('slug')
     return texts
 
 
 def _add_texts_to_corpora(corpora, text_ids=None, texts=None):
-    adding_texts = texts if texts else \
-		(Text.objects.filter(id__in=text_ids) if text_ids else Text.objects.all()).\
-        select_related('corpus').order_by('slug')
-    texts_by_id = {t.id: t for t in adding_texts}
-
-    def create_order(title, order):
-        'order should be a list of zero or one element containing a string'
-        if order and len(order) == 1:
-            return order[0]
-
-        return title
-
-    text_ids_and_orders = [(text.id, create_order(text.title, [o.value for o in text.text_meta.filter(name='order')]))
-                           for text in adding_texts]  # List of id, order tuples
-    sorted_text_ids_and_orders = sorted(text_ids_and_orders, key=lambda t: t[1])
-    sorted_text_ids = [tio[0] for tio in sorted_text_ids_and_orders]
+    'Set the texts of each corpus, in the order of their order metadata or else their titles, in one query'
+    adding_texts = (texts if texts is not None else
+        Text.objects.live().filter(id__in=text_ids) if text_ids else Text.objects.live()).order_by('order_key', 'slug')
+
+    texts_by_corpus_id = {}
+    for text in adding_texts:
+        texts_by_corpus_id.setdefault(text.corpus_id, []).append(text)
     for corpus in corpora:
-        corpus.texts = [texts_by_id[i] for i in sorted_text_ids if texts_by_id[i].corpus_id == corpus.id]
+        corpus.texts = texts_by_corpus_id.get(corpus.id, [])
 
 
 def _corpus_and_text_ids_from_filters(filters):
-    splittable = [sm.name for sm in SpecialMeta.objects.all() if sm.splittable]
+    splittable = [sm.name for sm in special_metas() if sm.splittable]
     corpus_ids_by_field = {}
     text_ids_by_field = {}
 
@@ -122,7 +177,7 @@ def _corpus_and_text_ids_from_filters(filters):
         corpus_ids = corpus_ids_by_field.get(name, set())
         text_ids   = text_ids_by_field  .get(name, set())
 
-        partly_filtered = Text.objects.filter(text_meta__name__iexact=name)
+        partly_filtered = Text.objects.live().filter(text_meta__name__iexact=name)
         texts = partly_filtered.filter(text_meta__value__contains=value) if name in splittable else \
 			partly_filtered.filter(text_meta__value__iexact=value)
 
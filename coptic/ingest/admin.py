@@ -1,9 +1,63 @@
+import json
 from django.contrib import admin
-from ingest.models import Ingest, ExpireIngest
+from django.db import transaction
+from django.utils.html import format_html
+from ingest.diff import affected_documents, report
+from ingest.models import Ingest, IngestDocument, IngestTiming, CorpusLock, ExpireIngest
+
+
+class IngestTimingInline(admin.TabularInline):
+    model = IngestTiming
+    fields = ('corpus', 'phase', 'count', 'total', 'p50', 'p95', 'max', 'peak_rss_kb', 'rss_delta_kb')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request):
+        return False
 
 
 class IngestAdmin(admin.ModelAdmin):
-    list_display = ('created', 'modified', 'num_corpora_ingested', 'num_texts_ingested')
+    inlines = [IngestTimingInline]
+    list_display = ('created', 'modified', 'status', 'worker', 'heartbeat', 'num_corpora_ingested', 'num_texts_ingested')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'worker', 'heartbeat', 'started', 'finished', 'error', 'diff_report')
+    actions = ['resume', 'ingest_affected_documents']
+
+    def resume(self, request, queryset):
+        ''' Queue failed ingests again. They pick up from the documents and visualizations they had not finished. '''
+        resumed = queryset.filter(status=Ingest.FAILED).update(status=Ingest.QUEUED)
+        self.message_user(request, '%d ingests queued to resume' % resumed)
+    resume.short_description = 'Resume selected failed ingests'
+
+    def diff_report(self, ingest):
+        ''' The differences a dry run found '''
+        return format_html('<pre>{0}</pre>', report(json.loads(ingest.diff))) if ingest.diff else ''
+    diff_report.short_description = 'Differences'
+
+    def ingest_affected_documents(self, request, queryset):
+        ''' Queue an incremental ingest of only the documents that finished dry runs found added or changed '''
+        queued = 0
+        for dry_run in queryset.filter(dry_run=True, status=Ingest.DONE).exclude(diff=''):
+            diff = json.loads(dry_run.diff)
+            targeted_documents = affected_documents(diff)
+            if not targeted_documents:
+                continue
+            # A worker could otherwise claim the queued ingest before it has its corpora
+            with transaction.atomic():
+                ingest = Ingest.objects.create(incremental=True, targeted_documents=targeted_documents, vis_workers=dry_run.vis_workers,
+                    corpus_processes=dry_run.corpus_processes)
+                ingest.corpora.add(*dry_run.corpora.filter(annis_corpus_name__in=[line.split('/', 1)[0] for line in targeted_documents.splitlines()]))
+            queued += 1
+        self.message_user(request, '%d ingests of the affected documents queued' % queued)
+    ingest_affected_documents.short_description = 'Ingest the documents selected dry runs found added or changed'
+
+
+class IngestDocumentAdmin(admin.ModelAdmin):
+    list_display = ('title', 'corpus', 'ingest', 'metadata_done', 'rss_delta_kb')
+    list_filter = ('ingest', 'corpus')
 
 admin.site.register(Ingest, IngestAdmin)
+admin.site.register(IngestDocument, IngestDocumentAdmin)
+admin.site.register(CorpusLock)
 admin.site.register(ExpireIngest)
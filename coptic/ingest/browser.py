@@ -0,0 +1,80 @@
+'Headless browser sessions that render visualizations needing JavaScript'
+
+import logging
+import os
+from django.conf import settings
+from selenium import webdriver
+from ingest.memory import tree_rss_kb
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserSession:
+	'''A headless browser kept across visualizations, texts and corpora. Before each page it is checked,
+	and it is replaced if it has stopped responding, has rendered INGEST_BROWSER_MAX_PAGES pages, or uses
+	more than INGEST_BROWSER_MAX_RSS_KB of memory. before_start is called before starting each browser.'''
+
+	def __init__(self, before_start=None, max_pages=None, max_rss_kb=None):
+		self.before_start = before_start
+		self.max_pages = max_pages or getattr(settings, 'INGEST_BROWSER_MAX_PAGES', 500)
+		self.max_rss_kb = max_rss_kb or getattr(settings, 'INGEST_BROWSER_MAX_RSS_KB', 1024 * 1024)
+		self.pages = 0
+		self._driver = None
+
+	def driver(self):
+		'Return a healthy browser, starting one if needed, or None if none can be started'
+		if self._driver:
+			reason = self._recycle_reason()
+			if reason:
+				logger.info('Replacing browser: %s' % reason)
+				self.quit()
+
+		if not self._driver:
+			logger.debug("Starting browser")
+			try:
+				if self.before_start:
+					self.before_start()
+				self._driver = webdriver.Chrome(os.environ.get('CHROMEDRIVER', '/usr/lib/chromium-browser/chromedriver'))
+			except Exception as e:
+				logger.error('Unable to start browser: %s' % e)
+				return None
+			logger.debug(self._driver)
+			self.pages = 0
+
+		return self._driver
+
+	def page_rendered(self):
+		self.pages += 1
+		try:
+			self._driver.delete_all_cookies()  # Pages must not see each other's state
+		except Exception as e:
+			logger.warning('Unable to delete cookies: %s' % e)  # The browser is checked before the next page
+
+	def quit(self):
+		if self._driver:
+			try:
+				self._driver.quit()
+			except Exception as e:
+				logger.warning('Error quitting browser: %s' % e)
+			self._driver = None
+
+	def _recycle_reason(self):
+		if self.pages >= self.max_pages:
+			return 'rendered %d pages' % self.pages
+		try:
+			self._driver.current_url  # A round trip to the browser
+		except Exception as e:
+			return 'not responding (%s)' % e
+		rss_kb = self.rss_kb()
+		if rss_kb > self.max_rss_kb:
+			return 'using %d kB of memory' % rss_kb
+		return None
+
+	def rss_kb(self):
+		'The resident memory of the browser: its driver process and all the processes it started'
+		try:
+			root_pid = self._driver.service.process.pid
+		except AttributeError:
+			return 0
+		return tree_rss_kb(root_pid)
+
@@ -0,0 +1,198 @@
+'''On-disk cache of the responses of the ANNIS server, used by IngestClient.
+
+Each response body is stored in a file named for the SHA-1 of its URL, next to a JSON file with the
+ETag and Last-Modified validators and the time it was stored. The server is asked whether a response
+has changed before it is served from disk, and a 304 reply refreshes the entry. Only within the TTL,
+0 by default, or in an offline ingest, is a response served without asking.'''
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from time import time
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+CHUNK_SIZE = 64 * 1024
+
+
+class ResponseCache:
+
+	def __init__(self, directory, ttl, max_bytes):
+		self.directory = directory
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self._lock = threading.Lock()
+		os.makedirs(directory, exist_ok=True)
+		self._size = sum(size for path, last_use, size in self._entries())
+
+	@classmethod
+	def from_settings(cls):
+		'The cache configured by the INGEST_CACHE_* settings, or None if there is no INGEST_CACHE_DIR'
+		directory = getattr(settings, 'INGEST_CACHE_DIR', None)
+		if not directory:
+			return None
+		return cls(directory, getattr(settings, 'INGEST_CACHE_TTL', 0),
+			getattr(settings, 'INGEST_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+	def lookup(self, url):
+		'Return the CachedResponse stored for the url, or None'
+		body_path, meta_path = self._paths(url)
+		try:
+			with open(meta_path, encoding='utf-8') as meta_file:
+				meta = json.load(meta_file)
+			os.utime(body_path)  # Recently used entries are evicted last
+		except (OSError, ValueError):
+			return None
+		return CachedResponse(body_path, meta)
+
+	def is_fresh(self, cached):
+		return time() - cached.meta['stored'] < self.ttl
+
+	def refresh(self, cached):
+		'Record that the server confirmed the cached response is current'
+		cached.meta['stored'] = time()
+		self._write_meta(self._paths(cached.meta['url'])[1], cached.meta)
+
+	@contextmanager
+	def writer(self, url, response):
+		'''Yield a file to write the body of the response to. It is stored for the url when the block
+		finishes, and discarded if the block raises.'''
+		body_path, meta_path = self._paths(url)
+		os.makedirs(os.path.dirname(body_path), exist_ok=True)
+		fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(body_path))
+		try:
+			with os.fdopen(fd, 'wb') as body_file:
+				yield body_file
+			size = os.path.getsize(temp_path)
+			os.replace(temp_path, body_path)
+		except BaseException:
+			os.remove(temp_path)
+			raise
+
+		self._write_meta(meta_path, {
+			'url':              url,
+			'etag':             response.headers.get('ETag', ''),
+			'last_modified':    response.headers.get('Last-Modified', ''),
+			'content_type':     response.headers.get('Content-Type', ''),
+			'stored':           time()})
+		with self._lock:
+			self._size += size
+			if self._size > self.max_bytes:
+				self._evict()
+
+	def _evict(self):
+		'''Delete the least recently used entries until the cache is below nine tenths of its maximum size. The
+		size is counted again from the disk, which other processes sharing the directory also write to.'''
+		entries = sorted(self._entries(), key=lambda entry: entry[1])
+		self._size = sum(size for body_path, last_use, size in entries)
+		target = self.max_bytes * 0.9
+		for body_path, last_use, size in entries:
+			if self._size <= target:
+				break
+			for path in (body_path + '.json', body_path):
+				try:
+					os.remove(path)
+				except OSError:  # Already evicted by another process
+					pass
+			self._size -= size
+		logger.info('Evicted cached responses down to %d bytes' % self._size)
+
+	def _write_meta(self, meta_path, meta):
+		fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(meta_path))
+		with os.fdopen(fd, 'w', encoding='utf-8') as meta_file:
+			json.dump(meta, meta_file)
+		os.replace(temp_path, meta_path)
+
+	def _paths(self, url):
+		key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+		body_path = os.path.join(self.directory, key[:2], key)
+		return body_path, body_path + '.json'
+
+	def _entries(self):
+		'The path, time of last use and size of each response body stored, leaving out any deleted meanwhile'
+		for dir_path, dir_names, file_names in os.walk(self.directory):
+			for file_name in file_names:
+				if len(file_name) == 40:  # A SHA-1, not metadata or a temporary file
+					body_path = os.path.join(dir_path, file_name)
+					try:
+						stat = os.stat(body_path)
+					except OSError:
+						continue
+					yield body_path, stat.st_mtime, stat.st_size
+
+
+class CachedResponse:
+	'A response served from the cache, with the parts of the requests Response interface the ingest uses'
+
+	def __init__(self, body_path, meta, status_code=200):
+		self.body_path = body_path
+		self.meta = meta
+		self.url = meta['url']
+		self.status_code = status_code
+		self.headers = requests.structures.CaseInsensitiveDict({
+			'ETag':             meta['etag'],
+			'Last-Modified':    meta['last_modified'],
+			'Content-Type':     meta['content_type']})
+
+	def not_modified(self):
+		'This response as a 304, for a caller whose conditional headers match it'
+		return CachedResponse(self.body_path, self.meta, 304)
+
+	def matches(self, headers):
+		'Whether the If-None-Match or If-Modified-Since header given names this response'
+		return bool((self.meta['etag'] and headers.get('If-None-Match') == self.meta['etag']) or
+			(self.meta['last_modified'] and headers.get('If-Modified-Since') == self.meta['last_modified']))
+
+	@property
+	def content(self):
+		if self.status_code == 304:
+			return b''
+		with open(self.body_path, 'rb') as body_file:
+			return body_file.read()
+
+	def iter_content(self, chunk_size=CHUNK_SIZE):
+		if self.status_code == 304:
+			return
+		with open(self.body_path, 'rb') as body_file:
+			for chunk in iter(lambda: body_file.read(chunk_size), b''):
+				yield chunk
+
+	def raise_for_status(self):
+		pass
+
+	def close(self):
+		pass
+
+
+class CachingResponse:
+	'A requests Response whose body is stored in the cache as it is read'
+
+	def __init__(self, response, cache):
+		self._response = response
+		self._cache = cache
+		self._content = None
+
+	def __getattr__(self, name):
+		return getattr(self._response, name)
+
+	def iter_content(self, chunk_size=CHUNK_SIZE):
+		with self._cache.writer(self._response.url, self._response) as body_file:
+			for chunk in self._response.iter_content(chunk_size):
+				body_file.write(chunk)
+				yield chunk
+
+	@property
+	def content(self):
+		if self._content is None:
+			self._content = b''.join(self.iter_content())
+		return self._content
+
+
+class CacheMiss(requests.RequestException):
+	'An offline ingest asked for a response that is not in the cache'
+	pass
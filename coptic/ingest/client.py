@@ -0,0 +1,81 @@
+'HTTP client shared by everything an ingest fetches from the ANNIS server'
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from ingest.cache import ResponseCache, CachingResponse, CacheMiss
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+class IngestClient:
+	'''A requests session whose keep-alive connections are pooled and shared between threads,
+	with the timeout applied to every request and a way to make many requests concurrently.
+	Responses are kept in the on-disk cache if INGEST_CACHE_DIR is set. An offline client only
+	serves responses from the cache, and raises CacheMiss for any other.'''
+
+	def __init__(self, concurrency=None, timeout=None, pool_size=None, offline=False):
+		self.concurrency = max(1, concurrency or getattr(settings, 'INGEST_HTTP_CONCURRENCY', 8))
+		self.timeout = timeout or getattr(settings, 'INGEST_HTTP_TIMEOUT', 60)
+		self.cache = ResponseCache.from_settings()
+		self.offline = offline
+		if offline and not self.cache:
+			raise ImproperlyConfigured('An offline ingest needs INGEST_CACHE_DIR to be set')
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_maxsize=max(self.concurrency, pool_size or 0))
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+
+	def get(self, url, **kwargs):
+		kwargs.setdefault('timeout', self.timeout)
+		if not self.cache:
+			return self.session.get(url, **kwargs)
+
+		# The caller's own conditional headers are answered from the cached response, which is
+		# itself revalidated with the validators it was stored with
+		headers = kwargs.pop('headers', None) or {}
+		cached = self.cache.lookup(url)
+		if cached and (self.offline or self.cache.is_fresh(cached)):
+			return self._answer(cached, headers)
+		if self.offline:
+			raise CacheMiss('%s is not in the cache' % url)
+
+		request_headers = {name: value for name, value in headers.items()
+			if name not in ('If-None-Match', 'If-Modified-Since')}
+		if cached and cached.meta['etag']:
+			request_headers['If-None-Match'] = cached.meta['etag']
+		if cached and cached.meta['last_modified']:
+			request_headers['If-Modified-Since'] = cached.meta['last_modified']
+
+		response = self.session.get(url, headers=request_headers, **kwargs)
+		if cached and response.status_code == 304:
+			response.close()
+			self.cache.refresh(cached)
+			return self._answer(cached, headers)
+		if response.status_code != 200:
+			return response
+		return CachingResponse(response, self.cache)
+
+	def _answer(self, cached, headers):
+		return cached.not_modified() if cached.matches(headers) else cached
+
+	def map(self, fn, items):
+		'Call fn on each of the items on up to concurrency threads. Return the results in the order of the items.'
+		with ThreadPoolExecutor(self.concurrency) as executor:
+			return list(executor.map(fn, items))
+
+	def close(self):
+		self.session.close()
+
+
+def default_client():
+	'The client used when the caller has none of its own'
+	global _default_client
+	with _default_client_lock:
+		if not _default_client:
+			_default_client = IngestClient()
+		return _default_client
@@ -0,0 +1,90 @@
+'''What an ingest would change: the documents and metadata ANNIS lists for each corpus, compared with the
+live texts, without fetching any visualization or writing any text'''
+
+import logging
+from ingest.metadata import fetch_text_metas, get_selected_annotation_fields, AnnisError
+
+logger = logging.getLogger(__name__)
+
+
+def diff_corpora(corpora, annis_server, client, timer):
+	'''Return, by corpus name, the titles of the documents ANNIS lists that have no live text ('added'), the
+	titles of live texts ANNIS no longer lists ('removed'), and the names of the metadata fields whose values
+	differ, by title ('changed'). A corpus or document that couldn't be fetched has its error instead.'''
+	from texts.models import Text
+
+	diff = {}
+	for corpus in corpora:
+		corpus_name = corpus.annis_corpus_name
+		try:
+			with timer.time(corpus, 'document names'):
+				titles = [fields[0] for fields in get_selected_annotation_fields(
+					annis_server.url_corpus_docname(corpus_name), ('name',), client=client)]
+		except AnnisError as e:
+			diff[corpus_name] = {'error': str(e)}
+			continue
+
+		live_texts = {text.title: text for text in Text.objects.live().filter(corpus=corpus).prefetch_related('text_meta')}
+		kept_titles = [title for title in titles if title in live_texts]
+		doc_metas = fetch_text_metas([annis_server.url_document_metadata(corpus_name, title) for title in kept_titles],
+			client, timer, corpus)
+
+		changed = {}
+		errors = {}
+		for title, doc_meta in zip(kept_titles, doc_metas):
+			if isinstance(doc_meta, AnnisError):
+				errors[title] = str(doc_meta)
+				continue
+			name_value_pairs, fingerprint = doc_meta
+			if fingerprint == live_texts[title].fingerprint:
+				continue
+			fields = changed_fields([(meta.name, meta.value) for meta in live_texts[title].text_meta.all()],
+				name_value_pairs)
+			if fields:
+				changed[title] = fields
+
+		diff[corpus_name] = {
+			'added': [title for title in titles if title not in live_texts],
+			'removed': sorted(set(live_texts) - set(titles)),
+			'changed': changed,
+			'errors': errors,
+		}
+		logger.info('Corpus %s: %d documents added, %d removed and %d changed' % (
+			corpus_name, len(diff[corpus_name]['added']), len(diff[corpus_name]['removed']), len(changed)))
+
+	return diff
+
+
+def changed_fields(old_pairs, new_pairs):
+	'''The names of the fields added, removed or given other values, from the (name, value) pairs of the old and new
+	metadata. A field may have several values, which are compared as a set.'''
+	def values_by_name(pairs):
+		values = {}
+		for name, value in pairs:
+			values.setdefault(name, set()).add(value)
+		return values
+
+	old_values, new_values = values_by_name(old_pairs), values_by_name(new_pairs)
+	return sorted(name for name in set(old_values) | set(new_values) if old_values.get(name) != new_values.get(name))
+
+
+def affected_documents(diff):
+	'The corpus/title lines of the added and changed documents, as the targeted documents of an Ingest'
+	return '\n'.join('%s/%s' % (corpus_name, title) for corpus_name, corpus_diff in sorted(diff.items())
+		for title in corpus_diff.get('added', []) + sorted(corpus_diff.get('changed', {})))
+
+
+def report(diff):
+	'The differences as readable text'
+	lines = []
+	for corpus_name, corpus_diff in sorted(diff.items()):
+		if 'error' in corpus_diff:
+			lines.append('%s: %s' % (corpus_name, corpus_diff['error']))
+			continue
+		lines.append('%s: %d added, %d removed, %d changed' % (corpus_name, len(corpus_diff['added']),
+			len(corpus_diff['removed']), len(corpus_diff['changed'])))
+		lines.extend('  + ' + title for title in corpus_diff['added'])
+		lines.extend('  - ' + title for title in corpus_diff['removed'])
+		lines.extend('  ~ %s: %s' % (title, ', '.join(fields)) for title, fields in sorted(corpus_diff['changed'].items()))
+		lines.extend('  ! %s: %s' % (title, error) for title, error in sorted(corpus_diff['errors'].items()))
+	return '\n'.join(lines)
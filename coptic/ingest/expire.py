@@ -4,17 +4,35 @@ expire.py
 Expire from their source lists in ANNIS
 
 """
+import datetime
+
 
 def expire_ingest(expire_ingest_instance):
 
     """
-    Set all texts is_expired value to true
+    Set is_expired to true on all texts, or on those of the corpus or
+    ingest the expiration is limited to, in a single update
     """
 
     from texts.models import Text
 
-    for text in Text.objects.all():
+    texts = Text.objects.all()
+    if expire_ingest_instance.corpus_id:
+        texts = texts.filter(corpus_id=expire_ingest_instance.corpus_id)
+    if expire_ingest_instance.ingest_id:
+        texts = texts.filter(ingest_id=expire_ingest_instance.ingest_id)
+
+    return texts.update(is_expired=True, modified=datetime.datetime.today())
+
+
+def unexpire_texts(corpus, titles):
 
-        text.is_expired = True
-        text.save()
+    """
+    Set is_expired back to false on the texts of the corpus that a
+    re-ingest found again, in a single update
+    """
+
+    from texts.models import Text
 
+    return Text.objects.filter(corpus=corpus, title__in=titles, is_expired=True).update(
+        is_expired=False, modified=datetime.datetime.today())
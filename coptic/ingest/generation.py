@@ -0,0 +1,64 @@
+'''Make the generation of texts an ingest built live, and delete the texts it replaced.
+
+An ingest builds its texts with is_live false, so readers keep seeing the previous texts, with all
+their metadata and visualizations, until the whole ingest is finished.'''
+
+import logging
+from django.db import transaction
+from ingest.expire import unexpire_texts
+
+logger = logging.getLogger(__name__)
+GARBAGE_BATCH_SIZE = 500
+
+
+def swap_in_generation(ingest, listed_titles_by_corpus):
+	'''In one transaction, make the texts of the documents the ingest completed live in place of the live texts of
+	the same documents. Live texts of documents the ingest did not complete, because ANNIS no longer lists them or
+	they failed, stay live. Return the number of documents the ingest did not complete, whether their metadata or
+	some of their visualizations are missing, which are left for a resume of the ingest to complete.'''
+	from texts.models import Text
+	from ingest.models import IngestDocument
+
+	incomplete = 0
+	with transaction.atomic():
+		for corpus, listed_titles in listed_titles_by_corpus.items():
+			formats = list(corpus.html_visualization_formats.all())
+			documents = list(IngestDocument.objects.filter(ingest=ingest, corpus=corpus)
+				.select_related('text').prefetch_related('visualizations_done'))
+			complete = [document for document in documents if document.is_complete(formats)]
+			incomplete += len(documents) - len(complete)
+			# Texts swapped in by an earlier run of the ingest are already live
+			built_text_ids = [document.text_id for document in complete if not document.text.is_live]
+			built_titles = list(Text.objects.filter(id__in=built_text_ids).values_list('title', flat=True))
+
+			replaced = Text.objects.live().filter(corpus=corpus, title__in=built_titles).update(is_live=False)
+			swapped_in = Text.objects.filter(id__in=built_text_ids).update(is_live=True)
+			unexpire_texts(corpus, listed_titles)
+			logger.info('Corpus %s: %d texts made live in place of %d' % (corpus.annis_corpus_name, swapped_in, replaced))
+
+	return incomplete
+
+
+def collect_garbage(ingest, corpora):
+	'''Delete the texts of the corpora that are not live and not being built by the ingest, and those the ingest
+	built that no checkpoint points to, then the visualizations, stylesheets and metadata no text uses any more'''
+	from texts.models import Text, TextMeta, HtmlVisualization, VisualizationStylesheet
+	from ingest.models import Ingest, IngestDocument
+
+	old_text_ids = list(Text.objects.filter(corpus__in=corpora, is_live=False).exclude(ingest=ingest).values_list('id', flat=True))
+	checkpoint_text_ids = IngestDocument.objects.filter(ingest=ingest).exclude(text=None).values_list('text_id', flat=True)
+	old_text_ids += list(Text.objects.filter(corpus__in=corpora, ingest=ingest, is_live=False)
+		.exclude(id__in=list(checkpoint_text_ids)).values_list('id', flat=True))
+	logger.info('Deleting %d replaced texts' % len(old_text_ids))
+
+	for start in range(0, len(old_text_ids), GARBAGE_BATCH_SIZE):
+		Text.objects.filter(id__in=old_text_ids[start:start + GARBAGE_BATCH_SIZE]).delete()
+
+	# Another running ingest may have created visualizations and metadata it has not yet linked to its texts
+	if Ingest.objects.filter(status=Ingest.RUNNING).exclude(id=ingest.id).exists():
+		logger.info('Leaving unused visualizations and metadata for the last running ingest to delete')
+		return
+
+	HtmlVisualization.objects.filter(text=None).delete()
+	VisualizationStylesheet.objects.filter(htmlvisualization=None).delete()
+	TextMeta.objects.filter(text=None).delete()
@@ -1,92 +1,285 @@
 'Fetch Texts from their source in ANNIS'
 
-from time import sleep
+import json
 import logging
+import multiprocessing
+import traceback
+from collections import OrderedDict
+from django.conf import settings
+from django.db import connections, transaction
 from django.utils.text import slugify
-from xvfbwrapper import Xvfb
-from ingest import metadata, vis
-from ingest.metadata import get_selected_annotation_fields
+from ingest import diff, metadata, vis
+from ingest.client import IngestClient
+from ingest.generation import swap_in_generation, collect_garbage
+from ingest.locks import corpus_locks
+from ingest.memory import MemoryBudget, MemoryBudgetExceeded, tree_rss_kb
+from ingest.metadata import get_selected_annotation_fields, AnnisError
+from ingest.timing import PhaseTimer
 from ingest.vis import VisServerRefusingConn
 
 logger = logging.getLogger(__name__)
 
 
-def fetch_texts(ingest_id):
-	from texts.models import Corpus, Text
+def fetch_texts(ingest_id, annis_server=None):
+	'''Run the ingest, from the given ANNIS server or else the first one saved. The corpora are spread across
+	the number of processes set on the ingest or by INGEST_CORPUS_PROCESSES, and locked until the ingest ends.'''
+	from texts.models import Corpus
 	from annis.models import AnnisServer
+	from ingest.models import Ingest
 
 	# Define HTML Formats and the ANNIS server to query
-	annis_server = AnnisServer.objects.all()[:1]
-
-	if annis_server:
-		annis_server = annis_server[0]
-		if not annis_server.base_domain.endswith("/"):
-			annis_server.base_domain += "/"
-	else:
-		logger.error("No ANNIS server found")
-		return False
-
-	ingest = _retry_getting_ingest(ingest_id)
-	if not ingest:
-		logger.error('Ingest with ID %d not found in database' % ingest_id)
+	if not annis_server:
+		annis_server = AnnisServer.objects.first()
+		if not annis_server:
+			raise IngestError("No ANNIS server found")
+	if not annis_server.base_domain.endswith("/"):
+		annis_server.base_domain += "/"
+
+	ingest = Ingest.objects.get(id=ingest_id)
+
+	ingesting_corpora = list(Corpus.objects.filter(id__in=(ingest.corpora.values_list('id', flat=True))))
+	if ingest.dry_run:
+		_dry_run(ingest, ingesting_corpora, annis_server)
 		return
 
-	logger.info("Starting virtual framebuffer")
-	vdisplay = Xvfb()
+	processes = min(len(ingesting_corpora), ingest.corpus_processes or getattr(settings, 'INGEST_CORPUS_PROCESSES', 1))
+	timer = PhaseTimer()
+
+	try:
+		with corpus_locks(ingest, ingesting_corpora):
+			if processes > 1:
+				listed_titles_by_corpus = _ingest_corpora_in_processes(ingest, ingesting_corpora, annis_server, processes, timer)
+			else:
+				listed_titles_by_corpus = _ingest_corpora(ingest, ingesting_corpora, annis_server, timer)
+
+			with timer.time(None, 'generation swap'):
+				incomplete = swap_in_generation(ingest, listed_titles_by_corpus)
+			with timer.time(None, 'garbage collection'):
+				collect_garbage(ingest, list(listed_titles_by_corpus.keys()))
+	finally:
+		timer.save(ingest)
+
+	# Corpora whose document names couldn't be fetched have no checkpoints, so a resume fetches them again
+	skipped_corpora = [corpus.annis_corpus_name for corpus in ingesting_corpora if corpus not in listed_titles_by_corpus]
+	if incomplete or skipped_corpora:
+		raise IngestError('%d documents could not be completed and %d corpora could not be listed (%s), and their '
+			'live texts were kept. Resume the ingest to complete them.' % (
+				incomplete, len(skipped_corpora), ', '.join(skipped_corpora) or 'none'))
+
+	logger.info('Finished')
+
+
+def _dry_run(ingest, corpora, annis_server):
+	'Record on the ingest what ingesting the corpora would change, without writing any text'
+	from ingest.models import Ingest
+
+	client = IngestClient(offline=ingest.offline)
+	timer = PhaseTimer()
+	try:
+		ingest_diff = diff.diff_corpora(corpora, annis_server, client, timer)
+	finally:
+		client.close()
+		timer.save(ingest)
+	Ingest.objects.filter(id=ingest.id).update(diff=json.dumps(ingest_diff, sort_keys=True))
+	logger.info('Finished dry run:\n' + diff.report(ingest_diff))
+
+
+def _ingest_corpora_in_processes(ingest, corpora, annis_server, processes, timer):
+	'''Ingest each corpus in a pool of processes, and merge their timings into the timer. Return the titles
+	ANNIS listed, by corpus. If any corpus failed, raise its error once all the others are finished.'''
+	logger.info('Ingesting %d corpora in %d processes' % (len(corpora), processes))
+	# Child processes must not share the parent's database connections
+	for conn in connections.all():
+		conn.close()
+
+	pool = multiprocessing.Pool(processes)
+	try:
+		results = [pool.apply_async(_ingest_corpus_process, (ingest.id, corpus.id, annis_server)) for corpus in corpora]
+		pool.close()
+		listed_titles_by_corpus = {}
+		errors = []
+		for result in results:
+			try:
+				listed_titles, exported_timings = result.get()
+			except Exception as e:
+				errors.append(e)
+				continue
+			listed_titles_by_corpus.update(listed_titles)
+			timer.merge(exported_timings)
+	finally:
+		pool.terminate()
+		pool.join()
+
+	# An exhausted memory budget queues the ingest again, which every other error would prevent
+	if errors:
+		raise ([e for e in errors if isinstance(e, MemoryBudgetExceeded)] or errors)[0]
+	return listed_titles_by_corpus
+
+
+def _ingest_corpus_process(ingest_id, corpus_id, annis_server):
+	'Ingest one corpus in a process of the pool, returning the titles ANNIS listed and the exported timings'
+	from texts.models import Corpus
+	from ingest.models import Ingest
+
+	timer = PhaseTimer()
 	try:
-		vdisplay.start()
-	except Exception as e:
-		logger.error('Unable to start Xvfb: %s' % e)
+		try:
+			listed_titles = _ingest_corpora(
+				Ingest.objects.get(id=ingest_id), [Corpus.objects.get(id=corpus_id)], annis_server, timer)
+		except (MemoryBudgetExceeded, VisServerRefusingConn):
+			raise
+		except Exception:
+			# The error is sent to the parent process, which may not be able to rebuild every kind of exception
+			raise IngestError(traceback.format_exc())
+	finally:
+		for conn in connections.all():
+			conn.close()
+	return listed_titles, timer.export()
+
 
-	ingesting_corpora = Corpus.objects.filter(id__in=(ingest.corpora.values_list('id', flat=True)))
+def _ingest_corpora(ingest, corpora, annis_server, timer):
+	'''Ingest the corpora one after another in this process, with one HTTP client and one pool of visualization
+	workers for all of them. Return the titles ANNIS listed, by corpus.'''
+	from texts.models import Text
+
+	client = IngestClient(pool_size=ingest.vis_workers or getattr(settings, 'INGEST_VIS_WORKERS', 1), offline=ingest.offline)
+	vis_pool = vis.VisWorkerPool(annis_server, ingest.vis_workers, client, timer)
+	vis_pool.start()
+	budget = MemoryBudget()
+
+	listed_titles_by_corpus = {}
+	documents_started = 0
 
 	try:
-		for corpus in ingesting_corpora:
+		for corpus in corpora:
 			corpus_name = corpus.annis_corpus_name
 			logger.info('Importing corpus ' + corpus.title)
-			doc_names_url = annis_server.url_corpus_docname(corpus_name)
-			doc_titles = [fields[0] for fields in get_selected_annotation_fields(doc_names_url, ('name',))]
-			logger.info('%d documents found for corpus %s: %s' % (len(doc_titles), corpus_name, ', '.join(doc_titles)))
+			documents = _documents_by_title(ingest, corpus, annis_server, client, timer)
+			if documents is None:
+				continue
+			listed_titles_by_corpus[corpus] = list(documents.keys())
+
+			formats = list(corpus.html_visualization_formats.all())
+			pending = [document for document in documents.values() if not document.is_complete(formats)]
+			if not pending:
+				logger.info('Corpus %s was completed before the ingest was resumed' % corpus_name)
+				continue
+			logger.info('%d documents to ingest from corpus %s: %s' % (
+				len(pending), corpus_name, ', '.join(document.title for document in pending)))
 
-			for title in doc_titles:
+			needing_meta = [document for document in pending if not (document.metadata_done and document.text_id)]
+			logger.info('Fetching text metadata of corpus %s' % corpus_name)
+			doc_metas = metadata.fetch_text_metas(
+				[annis_server.url_document_metadata(corpus_name, document.title) for document in needing_meta], client, timer, corpus)
+			doc_metas_by_title = {document.title: doc_meta for document, doc_meta in zip(needing_meta, doc_metas)}
+			meta_cache = {}
+			with timer.time(corpus, 'database writes'):
+				metadata.get_or_create_text_metas(
+					[pair for doc_meta in doc_metas if not isinstance(doc_meta, AnnisError) for pair in doc_meta[0]], meta_cache)
+
+			# An incremental ingest reuses what hasn't changed since the live texts were ingested
+			live_texts = {text.title: text for text in Text.objects.live().filter(corpus=corpus)} if ingest.incremental else {}
+
+			for document in pending:
+				if documents_started:  # Every run makes progress, however much memory it starts with
+					_keep_to_memory_budget(budget, vis_pool)
+				documents_started += 1
+
+				title = document.title
+				previous_text = live_texts.get(title)
 				logger.info('Importing ' + title)
 
-				Text.objects.filter(title=title).delete()
+				if title in doc_metas_by_title:
+					doc_meta = doc_metas_by_title[title]
+					if isinstance(doc_meta, AnnisError):
+						logger.error('Skipping %s: %s' % (title, doc_meta))
+						continue
+
+					rss_before = tree_rss_kb()
+					with timer.time(corpus, 'database writes'), transaction.atomic():
+						# Built alongside the live text, which readers keep seeing until the ingest is finished
+						text = Text()
+						text.title = title
+						text.slug = slugify(title).__str__()
+						text.corpus = corpus
+						text.ingest = ingest
+						text.is_live = False
+						text.save()
+
+						name_value_pairs, fingerprint = doc_meta
+						metadata.save_text_meta(text, name_value_pairs, fingerprint, meta_cache, previous_text)
 
-				text = Text()
-				text.title = title
-				text.slug = slugify(title).__str__()
-				text.corpus = corpus
-				text.ingest = ingest
-				text.save()
+						document.text = text
+						document.metadata_done = True
+						document.rss_delta_kb += tree_rss_kb() - rss_before
+						document.save()
+						# Any visualizations done were those of a text that was deleted before it was swapped in
+						document.visualizations_done.clear()
+						getattr(document, '_prefetched_objects_cache', {}).pop('visualizations_done', None)
+					ingest.add_to_counts(texts=1)
+				else:
+					text = document.text
 
-				doc_meta_url = annis_server.url_document_metadata(corpus_name, text.title)
-				metadata.collect_text_meta(doc_meta_url, text)
-				vis.collect(corpus, text, annis_server)
+				vis.collect(corpus, text, vis_pool, document, previous_text)
 
-				ingest.num_texts_ingested += 1
-				ingest.save()
+			ingest.add_to_counts(corpora=1)
 
-			ingest.num_corpora_ingested += 1
-			ingest.save()
+		vis_pool.join()
 	except VisServerRefusingConn:
 		logger.error('Aborting ingestion because visualization server repeatedly refused connections')
+		raise
+	finally:
+		vis_pool.stop()
+		client.close()
 
-	vdisplay.stop()
+	return listed_titles_by_corpus
 
-	logger.info('Finished')
 
+def _keep_to_memory_budget(budget, vis_pool):
+	'''If the worker is over its memory budget, quit the browsers. If it is still over, raise
+	MemoryBudgetExceeded, so that the ingest is queued again and resumed in a new worker process.'''
+	used_kb = budget.exceeded()
+	if not used_kb:
+		return
 
-def _retry_getting_ingest(id):
-	'This thread is started before the Ingest save is complete. Retry get if needed.'
-	from ingest.models import Ingest
-	retries_remaining = 10
-	ingest_object = None
-	while not ingest_object and retries_remaining:
-		sleep(1)
+	logger.warning('Using %d kB, over the memory budget of %d kB. Recycling the browsers.' % (used_kb, budget.budget_kb))
+	vis_pool.recycle_browsers()
+	used_kb = budget.exceeded()
+	if used_kb:
+		raise MemoryBudgetExceeded('Using %d kB without browsers, over the memory budget of %d kB' % (used_kb, budget.budget_kb))
+
+
+def _documents_by_title(ingest, corpus, annis_server, client, timer):
+	'''Return the checkpoints of the ingest for the documents of the corpus, by title. The first time,
+	fetch the document names and create the checkpoints. Return None if the names can't be fetched.'''
+	from ingest.models import IngestDocument
+
+	def checkpoints():
+		return OrderedDict((document.title, document) for document in IngestDocument.objects.filter(
+			ingest=ingest, corpus=corpus).select_related('text').prefetch_related('visualizations_done').order_by('id'))
+
+	documents = checkpoints()
+	if not documents:
+		corpus_name = corpus.annis_corpus_name
+		doc_names_url = annis_server.url_corpus_docname(corpus_name)
 		try:
-			ingest_object = Ingest.objects.get(id=id)
-		except Ingest.DoesNotExist:
-			logger.info("Ingest does not (yet) exist")
-			retries_remaining -= 1
-	return ingest_object
+			with timer.time(corpus, 'document names'):
+				doc_titles = [fields[0] for fields in get_selected_annotation_fields(doc_names_url, ('name',), client=client)]
+		except AnnisError as e:
+			logger.error('Skipping corpus %s: %s' % (corpus_name, e))
+			return None
+		logger.info('%d documents found for corpus %s' % (len(doc_titles), corpus_name))
+		targeted_titles = ingest.targeted_titles(corpus)
+		if targeted_titles is not None:
+			doc_titles = [title for title in doc_titles if title in targeted_titles]
+			logger.info('Ingesting the %d of them listed on the ingest' % len(doc_titles))
+
+		IngestDocument.objects.bulk_create([IngestDocument(ingest=ingest, corpus=corpus, title=title)
+			for title in OrderedDict.fromkeys(doc_titles)])
+		documents = checkpoints()
+
+	return documents
+
+
+class IngestError(Exception):
+	pass
@@ -0,0 +1,84 @@
+'''Advisory locks on corpora, held in the database for the length of an ingest, so that no two ingests
+write the texts of the same corpus at once, whichever worker or process runs them.
+
+Each lock is owned by the token of the run that acquired it, which refreshes the heartbeat of its locks while
+it holds them. A lock whose heartbeat is older than INGEST_STALE_SECONDS was left by a run that stopped, and
+is taken over.'''
+
+import datetime
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from time import sleep
+from uuid import uuid4
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError, IntegrityError
+
+logger = logging.getLogger(__name__)
+POLL_SECONDS = 5
+
+
+@contextmanager
+def corpus_locks(ingest, corpora):
+	'''Hold the locks of the corpora for the ingest while the block runs. Corpora locked by another
+	run are waited for, in order of id so that two runs never wait for each other.'''
+	from ingest.models import CorpusLock
+	token = '%s:%d:%s' % (socket.gethostname(), os.getpid(), uuid4().hex)
+	heartbeat = _LockHeartbeat(token)
+	heartbeat.start()
+	try:
+		for corpus in sorted(corpora, key=lambda corpus: corpus.id):
+			_acquire(ingest, corpus, token)
+		yield
+	finally:
+		heartbeat.stop()
+		CorpusLock.objects.filter(token=token).delete()
+
+
+def _acquire(ingest, corpus, token):
+	from ingest.models import CorpusLock
+	waiting = False
+	while True:
+		stale_before = datetime.datetime.today() - datetime.timedelta(seconds=getattr(settings, 'INGEST_STALE_SECONDS', 300))
+		stale_locks = CorpusLock.objects.filter(corpus=corpus, heartbeat__lt=stale_before)
+		if stale_locks.exists():
+			logger.warning('Taking over the lock of corpus %s, abandoned by a run that stopped' % corpus.annis_corpus_name)
+			stale_locks.delete()
+		try:
+			now = datetime.datetime.today()
+			with transaction.atomic():
+				CorpusLock.objects.create(corpus=corpus, ingest=ingest, worker=ingest.worker, token=token,
+					acquired=now, heartbeat=now)
+			return
+		except IntegrityError:
+			if not waiting:
+				logger.info('Waiting for another ingest to finish writing corpus %s' % corpus.annis_corpus_name)
+				waiting = True
+			sleep(POLL_SECONDS)
+
+
+class _LockHeartbeat(threading.Thread):
+	'Periodically record that the run holding the locks of a token is alive'
+
+	def __init__(self, token):
+		super(_LockHeartbeat, self).__init__(name='corpus-lock-heartbeat')
+		self.daemon = True
+		self.token = token
+		self._stopped = threading.Event()
+
+	def run(self):
+		from ingest.models import CorpusLock
+		while not self._stopped.wait(getattr(settings, 'INGEST_HEARTBEAT_SECONDS', 30)):
+			try:
+				CorpusLock.objects.filter(token=self.token).update(heartbeat=datetime.datetime.today())
+			except DatabaseError as e:
+				logger.warning('Unable to refresh the corpus locks: %s' % e)
+			finally:
+				# Not kept open, as the ingest forks processes that would share it
+				connection.close()
+
+	def stop(self):
+		self._stopped.set()
+		self.join()
@@ -0,0 +1,88 @@
+import datetime
+from optparse import make_option
+from time import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from ingest.ingest import fetch_texts
+from ingest.standin import StandinAnnisServer
+from ingest.timing import peak_rss_kb
+
+
+class Command(BaseCommand):
+	help = '''Run an ingest of synthetic corpora from a local stand-in for the ANNIS server, in a test database,
+and report its throughput, the time of each phase and the peak memory use. The response cache is not used.'''
+	option_list = BaseCommand.option_list + (
+		make_option('--corpora', type='int', default=2,
+			help='Number of corpora'),
+		make_option('--documents', type='int', default=50,
+			help='Number of documents in each corpus'),
+		make_option('--formats', type='int', default=2,
+			help='Number of visualization formats of each corpus'),
+		make_option('--meta-fields', type='int', default=20,
+			help='Number of metadata fields of each document'),
+		make_option('--vis-bytes', type='int', default=20000,
+			help='Size of each visualization'),
+		make_option('--latency', type='float', default=0.0,
+			help='Seconds the stand-in server waits before each response'),
+		make_option('--vis-workers', type='int', default=0,
+			help='Number of visualization workers. 0 uses the INGEST_VIS_WORKERS setting.'),
+		make_option('--corpus-processes', type='int', default=0,
+			help='Number of corpora ingested in parallel. 0 uses the INGEST_CORPUS_PROCESSES setting.'),
+		make_option('--incremental', action='store_true', default=False,
+			help='Run an incremental ingest after the first, and report on it too'),
+	)
+
+	def handle(self, *args, **options):
+		old_database_name = connection.settings_dict['NAME']
+		connection.creation.create_test_db(verbosity=0, autoclobber=True)
+		corpus_names = ['benchmark.corpus%d' % i for i in range(options['corpora'])]
+		standin = StandinAnnisServer(corpus_names, options['documents'], options['meta_fields'],
+			options['vis_bytes'], options['latency'])
+		standin.start()
+
+		try:
+			with override_settings(INGEST_CACHE_DIR=None):
+				corpora = _create_corpora(corpus_names, options['formats'])
+				self._run(corpora, standin, options, False)
+				if options['incremental']:
+					self._run(corpora, standin, options, True)
+		finally:
+			standin.stop()
+			connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+	def _run(self, corpora, standin, options, incremental):
+		from ingest.models import Ingest
+		from texts.models import Text
+
+		ingest = Ingest.objects.create(vis_workers=options['vis_workers'],
+			corpus_processes=options['corpus_processes'], incremental=incremental)
+		ingest.corpora.add(*corpora)
+		start = time()
+		fetch_texts(ingest.id, standin.annis_server())
+		seconds = time() - start
+
+		texts = Text.objects.live().filter(ingest=ingest).count()
+		self.stdout.write('%s ingest: %d texts in %.1f s, %.2f texts/s, peak memory %d KB' % (
+			'Incremental' if incremental else 'Full', texts, seconds, texts / seconds, peak_rss_kb()))
+		self.stdout.write('%-30s %6s %10s %8s %8s %8s' % ('Phase', 'Count', 'Total (s)', 'p50', 'p95', 'Max'))
+		for timing in ingest.timings.filter(corpus=None).order_by('-total'):
+			self.stdout.write('%-30s %6d %10.2f %8.3f %8.3f %8.3f' % (
+				timing.phase, timing.count, timing.total, timing.p50, timing.p95, timing.max))
+
+
+def _create_corpora(corpus_names, num_formats):
+	'Create the corpora, and the visualization formats each has'
+	from texts.models import Corpus, HtmlVisualizationFormat
+
+	formats = [HtmlVisualizationFormat.objects.create(title='Format %d' % i, button_title='Format %d' % i,
+		slug='format%d' % i) for i in range(num_formats)]
+
+	# Corpus.save looks up the corpus on GitHub, which has none of these
+	now = datetime.datetime.today()
+	Corpus.objects.bulk_create([Corpus(created=now, modified=now, title=name, slug=name.replace('.', '-'),
+		urn_code='urn:cts:copticLit:' + name, annis_corpus_name=name, github='') for name in corpus_names])
+	corpora = list(Corpus.objects.filter(annis_corpus_name__in=corpus_names))
+	for corpus in corpora:
+		corpus.html_visualization_formats.add(*formats)
+	return corpora
@@ -0,0 +1,68 @@
+import logging
+import multiprocessing
+import sys
+from optparse import make_option
+from time import sleep
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from ingest.tasks import claim_next_ingest, run_ingest, worker_name
+
+logger = logging.getLogger(__name__)
+OVER_MEMORY_BUDGET_EXIT_CODE = 3
+
+
+class Command(BaseCommand):
+	help = 'Run queued ingests in worker processes'
+	option_list = BaseCommand.option_list + (
+		make_option('--processes', type='int', default=getattr(settings, 'INGEST_WORKER_PROCESSES', 1),
+			help='Number of ingests to run in parallel'),
+		make_option('--poll', type='int', default=10,
+			help='Seconds to wait between looks at the queue when it is empty'),
+		make_option('--once', action='store_true', default=False,
+			help='Run the queued ingests, then exit'),
+	)
+
+	def handle(self, *args, **options):
+		# Ingests run in child processes, even if only one, so that a worker over its memory budget can exit
+		# and free all its memory. Child processes must not share the parent's database connections.
+		for conn in connections.all():
+			conn.close()
+
+		processes = {i: _start_worker_process(i, options['poll'], options['once']) for i in range(options['processes'])}
+		try:
+			while processes:
+				sleep(1)
+				for i, process in list(processes.items()):
+					if process.is_alive():
+						continue
+					del processes[i]
+					# A worker over its memory budget queued its ingest again for another to resume
+					if not options['once'] or process.exitcode == OVER_MEMORY_BUDGET_EXIT_CODE:
+						logger.warning('%s exited with code %s. Starting another.' % (process.name, process.exitcode))
+						processes[i] = _start_worker_process(i, options['poll'], options['once'])
+		except KeyboardInterrupt:
+			for process in processes.values():
+				process.terminate()
+
+
+def _start_worker_process(i, poll_seconds, once):
+	process = multiprocessing.Process(target=_work, args=(poll_seconds, once), name='ingest-worker-%d' % i)
+	process.start()
+	return process
+
+
+def _work(poll_seconds, once):
+	'Claim and run ingests until the queue is empty, if once, or forever'
+	worker = worker_name()
+	logger.info('Ingest worker %s started' % worker)
+
+	while True:
+		ingest = claim_next_ingest(worker)
+		if ingest:
+			if run_ingest(ingest.id, worker):
+				sys.exit(OVER_MEMORY_BUDGET_EXIT_CODE)
+		elif once:
+			break
+		else:
+			sleep(poll_seconds)
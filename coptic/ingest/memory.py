@@ -0,0 +1,63 @@
+'Memory use of an ingest worker and the browsers it started, read from /proc, and the budget it must keep to'
+
+import logging
+import os
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBudget:
+	'''The resident memory an ingest worker may use, including its browsers, from INGEST_MEMORY_BUDGET_KB.
+	0 means no budget.'''
+
+	def __init__(self, budget_kb=None):
+		self.budget_kb = budget_kb if budget_kb is not None else getattr(settings, 'INGEST_MEMORY_BUDGET_KB', 0)
+
+	def exceeded(self):
+		'The memory in use if it exceeds the budget, else None'
+		if not self.budget_kb:
+			return None
+		used_kb = tree_rss_kb()
+		return used_kb if used_kb > self.budget_kb else None
+
+
+def tree_rss_kb(root_pid=None):
+	'The resident memory of the process, this one by default, and all its descendants'
+	return sum(rss_kb(pid) for pid in descendant_pids(root_pid or os.getpid()))
+
+
+def descendant_pids(root_pid):
+	'The pid and the pids of all its descendants'
+	children = {}
+	for name in os.listdir('/proc'):
+		if not name.isdigit():
+			continue
+		try:
+			with open('/proc/%s/stat' % name) as stat_file:
+				# The command name, in parentheses, may contain spaces
+				parent_pid = int(stat_file.read().rsplit(')', 1)[1].split()[1])
+		except (OSError, IndexError, ValueError):
+			continue  # The process has exited
+		children.setdefault(parent_pid, []).append(int(name))
+
+	pids = [root_pid]
+	for pid in pids:
+		pids.extend(children.get(pid, []))
+	return pids
+
+
+def rss_kb(pid):
+	try:
+		with open('/proc/%d/status' % pid) as status_file:
+			for line in status_file:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1])
+	except (OSError, ValueError):
+		pass
+	return 0
+
+
+class MemoryBudgetExceeded(Exception):
+	'The worker is over its memory budget even without browsers, and must be replaced by a new process'
+	pass
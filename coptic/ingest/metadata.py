@@ -1,39 +1,169 @@
+import hashlib
 import logging
+from contextlib import closing
+from xml.etree import ElementTree
 import requests
-from bs4 import BeautifulSoup
-from texts.models import TextMeta
+from django.db import IntegrityError, transaction
+from ingest.client import default_client
+from ingest.timing import PhaseTimer
 
 logger = logging.getLogger(__name__)
+CHUNK_SIZE = 64 * 1024
 
 
-def collect_text_meta(url, text):
-	logger.info("Fetching and saving text metadata")
-	text.text_meta.remove()
-	all_meta = list(TextMeta.objects.all())
+def fetch_text_metas(urls, client=None, timer=None, corpus=None):
+	'''Fetch the metadata of many documents concurrently. Return, in the order of the urls, a
+	(name_value_pairs, fingerprint) tuple for each document, or the AnnisError that prevented fetching it.
+	Each fetch is recorded on the timer, if given, under the corpus.'''
+	client = client or default_client()
+	timer = timer or PhaseTimer()
 
-	for name, value in get_selected_annotation_fields(url, ('name', 'value')):
-		existing = [item for item in all_meta if item.name == name and item.value == value]
-		if existing:
-			if len(existing) > 1:
-				logger.info('There are %d duplicates for %s: %s.' % (len(existing) - 1, name, value))
-			meta = existing[0]
-		else:
-			meta = TextMeta()
-			meta.name, meta.value = name, value
-			meta.save()
-		text.text_meta.add(meta)
+	def fetch_or_error(url):
+		try:
+			with timer.time(corpus, 'metadata'):
+				return fetch_text_meta(url, client)
+		except AnnisError as e:
+			return e
 
+	return client.map(fetch_or_error, urls)
 
-def get_selected_annotation_fields(url, field_names):
-	'Fetch from the url, and return the requested fields for each annotation found, in a list of lists'
+
+def fetch_text_meta(url, client=None):
+	'Fetch the metadata of a document. Return its (name, value) pairs and the fingerprint of the response.'
+	digest = hashlib.sha1()
+	name_value_pairs = get_selected_annotation_fields(url, ('name', 'value'), digest, client)
+	return name_value_pairs, digest.hexdigest()
+
+
+def save_text_meta(text, name_value_pairs, fingerprint, meta_cache=None, previous_text=None):
+	'''Save the metadata of a newly built text, and set the fingerprint of the metadata and the order key on it. If the previous
+	text of the document has the same fingerprint, link to its metadata instead. Return whether the metadata changed.
+	meta_cache maps (name, value hash) to TextMeta, and can be shared across the texts of a corpus.'''
+	from texts.models import Text
+	changed = not (previous_text and previous_text.fingerprint == fingerprint)
+	if changed:
+		logger.info("Saving text metadata")
+		meta_ids = set(meta.id for meta in get_or_create_text_metas(name_value_pairs, {} if meta_cache is None else meta_cache))
+	else:
+		logger.info("Text metadata unchanged")
+		meta_ids = previous_text.text_meta.values_list('id', flat=True)
+
+	TextTextMeta = Text.text_meta.through
+	TextTextMeta.objects.bulk_create([TextTextMeta(text_id=text.id, textmeta_id=meta_id) for meta_id in meta_ids])
+
+	text.fingerprint = fingerprint
+	text.order_key = Text.make_order_key(text.title, list(set(value for name, value in name_value_pairs if name == 'order')))
+	text.save()
+	return changed
+
+
+def get_or_create_text_metas(name_value_pairs, meta_cache):
+	'''Return the TextMeta for each (name, value) pair, looking up and creating the missing ones in one batch each.
+	Calling this with all the pairs of a corpus first makes the later calls for each text free.'''
+	from texts.models import TextMeta
+	keys = [(name, TextMeta.hash_value(value)) for name, value in name_value_pairs]
+	values_by_key = dict(zip(keys, (value for name, value in name_value_pairs)))
+
+	def cache_existing(keys):
+		for meta in TextMeta.objects.filter(value_hash__in=set(value_hash for name, value_hash in keys)):
+			meta_cache[(meta.name, meta.value_hash)] = meta
+
+	uncached = [key for key in values_by_key if key not in meta_cache]
+	if uncached:
+		cache_existing(uncached)
+		missing = [key for key in uncached if key not in meta_cache]
+		if missing:
+			try:
+				with transaction.atomic():
+					TextMeta.objects.bulk_create([TextMeta(name=name, value=values_by_key[(name, value_hash)],
+						value_hash=value_hash) for name, value_hash in missing])
+			except IntegrityError:
+				logger.info('Another ingest created some of the same metadata. Creating one at a time.')
+				for name, value_hash in missing:
+					TextMeta.objects.get_or_create(name=name, value_hash=value_hash,
+						defaults={'value': values_by_key[(name, value_hash)]})
+			cache_existing(missing)  # bulk_create does not set ids on every database
+
+	return [meta_cache[key] for key in keys]
+
+
+def get_selected_annotation_fields(url, field_names, digest=None, client=None):
+	'''Fetch from the url, and return a tuple of the requested fields for each annotation found, in a list.
+	The response body is fed to digest, if given. Raise an AnnisError if the annotations can’t be fetched.'''
+	annotation_sets = list(iter_selected_annotation_fields(url, field_names, digest, client))
+	logger.info('Got %d annotation sets from %s' % (len(annotation_sets), url))
+	return annotation_sets
+
+
+def iter_selected_annotation_fields(url, field_names, digest=None, client=None):
+	'''Fetch from the url, and yield a tuple of the requested fields for each annotation as the response
+	arrives. Only the annotation being read is kept in memory. The response body is fed to digest, if given.'''
 	try:
-		response = requests.get(url)
-		content = response.content
-		soup = BeautifulSoup(content, from_encoding='utf-8')
-		annotations = soup.find_all("annotation")
-		annotation_sets = [[a.find(n).text for n in field_names] for a in annotations]
-		logger.info('Got %d annotation sets from %s' % (len(annotation_sets), url))
-		return annotation_sets
-	except Exception as e:
-		logger.exception(e)
-		return []
+		response = (client or default_client()).get(url, stream=True)
+	except requests.RequestException as e:
+		raise AnnisConnectionError('Unable to get %s: %s' % (url, e))
+
+	with closing(response):
+		if response.status_code != 200:
+			raise AnnisResponseError('%s returned HTTP status %d' % (url, response.status_code))
+
+		parser = ElementTree.XMLPullParser(events=('start', 'end'))
+		open_elements = []
+		try:
+			for chunk in response.iter_content(CHUNK_SIZE):
+				if digest:
+					digest.update(chunk)
+				parser.feed(chunk)
+				for fields in _read_annotations(parser, field_names, open_elements, url):
+					yield fields
+			parser.close()
+			for fields in _read_annotations(parser, field_names, open_elements, url):
+				yield fields
+		except requests.RequestException as e:
+			raise AnnisConnectionError('Connection lost reading %s: %s' % (url, e))
+		except ElementTree.ParseError as e:
+			raise AnnisParseError('Unable to parse %s: %s' % (url, e))
+
+
+def _read_annotations(parser, field_names, open_elements, url):
+	'Yield the requested fields of each annotation the parser has finished, and discard the annotation'
+	for event, elem in parser.read_events():
+		if event == 'start':
+			open_elements.append(elem)
+			continue
+
+		open_elements.pop()
+		if _local_name(elem.tag) == 'annotation':
+			texts_by_name = {}
+			for descendant in elem.iter():
+				texts_by_name.setdefault(_local_name(descendant.tag), descendant.text or '')
+
+			missing = [n for n in field_names if n not in texts_by_name]
+			if missing:
+				raise AnnisParseError('Annotation in %s has no %s' % (url, ', '.join(missing)))
+
+			if open_elements:
+				open_elements[-1].remove(elem)
+			yield tuple(texts_by_name[n] for n in field_names)
+
+
+def _local_name(tag):
+	'The lower-case tag name without any namespace'
+	return tag.rsplit('}', 1)[-1].lower()
+
+
+class AnnisError(Exception):
+	'Annotations couldn’t be fetched from the ANNIS server'
+	pass
+
+
+class AnnisConnectionError(AnnisError):
+	pass
+
+
+class AnnisResponseError(AnnisError):
+	pass
+
+
+class AnnisParseError(AnnisError):
+	pass
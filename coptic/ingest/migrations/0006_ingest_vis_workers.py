@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0005_auto_20161212_2341'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingest',
+            name='vis_workers',
+            field=models.PositiveIntegerField(default=0, help_text='Number of browsers fetching visualizations in parallel. 0 uses the INGEST_VIS_WORKERS setting.'),
+        ),
+    ]
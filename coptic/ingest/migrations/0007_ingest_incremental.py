@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0006_ingest_vis_workers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingest',
+            name='incremental',
+            field=models.BooleanField(default=False, help_text='Leave alone the metadata and visualizations of documents that have not changed'),
+        ),
+    ]
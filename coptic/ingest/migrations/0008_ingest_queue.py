@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0007_ingest_incremental'),
+    ]
+
+    operations = [
+        # Ingests made before the queue existed have already run
+        migrations.AddField(
+            model_name='ingest',
+            name='status',
+            field=models.CharField(max_length=20, choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='done', editable=False, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='ingest',
+            name='status',
+            field=models.CharField(max_length=20, choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', editable=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='ingest',
+            name='worker',
+            field=models.CharField(max_length=200, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ingest',
+            name='heartbeat',
+            field=models.DateTimeField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ingest',
+            name='started',
+            field=models.DateTimeField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ingest',
+            name='finished',
+            field=models.DateTimeField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ingest',
+            name='error',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0023_textmeta_value_hash'),
+        ('ingest', '0008_ingest_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestDocument',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True, verbose_name='ID', auto_created=True)),
+                ('title', models.CharField(max_length=200)),
+                ('metadata_done', models.BooleanField(default=False)),
+                ('corpus', models.ForeignKey(to='texts.Corpus')),
+                ('ingest', models.ForeignKey(related_name='documents', to='ingest.Ingest')),
+                ('text', models.ForeignKey(null=True, blank=True, to='texts.Text', on_delete=django.db.models.deletion.SET_NULL)),
+                ('visualizations_done', models.ManyToManyField(blank=True, to='texts.HtmlVisualizationFormat')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ingestdocument',
+            unique_together=set([('ingest', 'corpus', 'title')]),
+        ),
+    ]
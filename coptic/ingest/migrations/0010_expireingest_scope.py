@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0023_textmeta_value_hash'),
+        ('ingest', '0009_ingestdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expireingest',
+            name='corpus',
+            field=models.ForeignKey(null=True, blank=True, to='texts.Corpus', help_text='Only expire the texts of this corpus'),
+        ),
+        migrations.AddField(
+            model_name='expireingest',
+            name='ingest',
+            field=models.ForeignKey(null=True, blank=True, to='ingest.Ingest', help_text='Only expire the texts this ingest created'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0024_text_is_live'),
+        ('ingest', '0010_expireingest_scope'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestTiming',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True, verbose_name='ID', auto_created=True)),
+                ('phase', models.CharField(max_length=200)),
+                ('count', models.PositiveIntegerField()),
+                ('total', models.FloatField(help_text='Seconds')),
+                ('p50', models.FloatField(help_text='Seconds')),
+                ('p95', models.FloatField(help_text='Seconds')),
+                ('max', models.FloatField(help_text='Seconds')),
+                ('peak_rss_kb', models.PositiveIntegerField(help_text='Peak resident memory in kB, of the worker plus its largest finished child process')),
+                ('corpus', models.ForeignKey(null=True, blank=True, to='texts.Corpus')),
+                ('ingest', models.ForeignKey(related_name='timings', to='ingest.Ingest')),
+            ],
+            options={
+                'ordering': ('corpus', '-total'),
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0011_ingesttiming'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingest',
+            name='offline',
+            field=models.BooleanField(default=False, help_text='Use only responses in the INGEST_CACHE_DIR cache, without contacting the ANNIS server'),
+        ),
+    ]
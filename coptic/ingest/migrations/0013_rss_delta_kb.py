@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0012_ingest_offline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestdocument',
+            name='rss_delta_kb',
+            field=models.IntegerField(default=0, editable=False, help_text='Growth in kB of the resident memory of the worker and its browsers while ingesting the document'),
+        ),
+        migrations.AddField(
+            model_name='ingesttiming',
+            name='rss_delta_kb',
+            field=models.IntegerField(default=0, help_text='Total growth in kB of the resident memory of the worker and its browsers during the phase'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0026_htmlvisualization_html_gz'),
+        ('ingest', '0013_rss_delta_kb'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingest',
+            name='corpus_processes',
+            field=models.PositiveIntegerField(default=0, help_text='Number of corpora ingested in parallel, each in its own process with its own browsers. 0 uses the INGEST_CORPUS_PROCESSES setting.'),
+        ),
+        migrations.CreateModel(
+            name='CorpusLock',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True, verbose_name='ID', auto_created=True)),
+                ('worker', models.CharField(max_length=200, blank=True)),
+                ('acquired', models.DateTimeField()),
+                ('corpus', models.OneToOneField(related_name='ingest_lock', to='texts.Corpus')),
+                ('ingest', models.ForeignKey(related_name='corpus_locks', to='ingest.Ingest')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
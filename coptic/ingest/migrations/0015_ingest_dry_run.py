@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0014_corpus_processes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingest',
+            name='dry_run',
+            field=models.BooleanField(default=False, help_text='Only compare the documents and metadata in ANNIS with the live texts, and record the differences'),
+        ),
+        migrations.AddField(
+            model_name='ingest',
+            name='targeted_documents',
+            field=models.TextField(blank=True, help_text='Only ingest these documents, one corpus name/document name per line. Blank ingests every document.'),
+        ),
+        migrations.AddField(
+            model_name='ingest',
+            name='diff',
+            field=models.TextField(blank=True, editable=False, help_text='The differences a dry run found, as JSON'),
+        ),
+    ]
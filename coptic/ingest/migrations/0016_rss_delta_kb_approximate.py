@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0015_ingest_dry_run'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingestdocument',
+            name='rss_delta_kb',
+            field=models.IntegerField(default=0, editable=False, help_text='Approximate growth in kB of the resident memory of the worker and its browsers while ingesting the document. It includes the growth from the other documents being ingested at the same time, so compare the ingest timings of each corpus instead.'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0016_rss_delta_kb_approximate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='corpuslock',
+            name='token',
+            field=models.CharField(default='', max_length=200, editable=False, help_text='Identifies the run of the ingest that holds the lock'),
+            preserve_default=False,
+        ),
+        # Locks from before heartbeats are stale, and taken over by the next ingest of their corpus
+        migrations.AddField(
+            model_name='corpuslock',
+            name='heartbeat',
+            field=models.DateTimeField(default=datetime.datetime(1970, 1, 1), editable=False, help_text='Refreshed while the lock is held. A lock older than INGEST_STALE_SECONDS is taken over.'),
+            preserve_default=False,
+        ),
+    ]
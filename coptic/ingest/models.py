@@ -2,43 +2,156 @@ import datetime
 import logging
 from django.db import models
 from ingest.expire import expire_ingest
-from ingest.tasks import ingest_asynch
-from texts.models import Corpus
+from texts.models import Corpus, HtmlVisualizationFormat
 
 
 class Ingest(models.Model):
     """
-    Model for creating new ingests of documents and metadata
+    Model for creating new ingests of documents and metadata. Saving a new
+    ingest queues it, and the ingest_worker management command runs it.
 
     """
+    QUEUED  = 'queued'
+    RUNNING = 'running'
+    DONE    = 'done'
+    FAILED  = 'failed'
+    STATUS_CHOICES = ((QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed'))
+
     created                 = models.DateTimeField(editable=False)
     modified                = models.DateTimeField(editable=False)
     corpora                 = models.ManyToManyField(Corpus)
     num_corpora_ingested    = models.PositiveIntegerField(default=0, editable=False)
     num_texts_ingested      = models.PositiveIntegerField(default=0, editable=False)
+    vis_workers             = models.PositiveIntegerField(default=0,
+        help_text='Number of browsers fetching visualizations in parallel. 0 uses the INGEST_VIS_WORKERS setting.')
+    corpus_processes        = models.PositiveIntegerField(default=0,
+        help_text='Number of corpora ingested in parallel, each in its own process with its own browsers. '
+                  '0 uses the INGEST_CORPUS_PROCESSES setting.')
+    incremental             = models.BooleanField(default=False,
+        help_text='Leave alone the metadata and visualizations of documents that have not changed')
+    offline                 = models.BooleanField(default=False,
+        help_text='Use only responses in the INGEST_CACHE_DIR cache, without contacting the ANNIS server')
+    dry_run                 = models.BooleanField(default=False,
+        help_text='Only compare the documents and metadata in ANNIS with the live texts, and record the differences')
+    targeted_documents      = models.TextField(blank=True,
+        help_text='Only ingest these documents, one corpus name/document name per line. Blank ingests every document.')
+    diff                    = models.TextField(blank=True, editable=False,
+        help_text='The differences a dry run found, as JSON')
+    status                  = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, editable=False, db_index=True)
+    worker                  = models.CharField(max_length=200, blank=True, editable=False)
+    heartbeat               = models.DateTimeField(null=True, editable=False)
+    started                 = models.DateTimeField(null=True, editable=False)
+    finished                = models.DateTimeField(null=True, editable=False)
+    error                   = models.TextField(blank=True, editable=False)
 
     def __str__(self):
         return self.created.strftime('%H:%S %d.%b.%Y')
 
     def save(self, *args, **kwargs):
         ''' On save, update timestamps '''
-        first_save = not self.id
-        if first_save:
+        if not self.id:
             self.created = datetime.datetime.today()
         self.modified = datetime.datetime.today()
 
         super(Ingest, self).save(*args, **kwargs)
 
-        if first_save:
-            ingest_asynch(self.id)
+    def targeted_titles(self, corpus):
+        ''' The titles of the documents of the corpus to ingest, or None to ingest all of them '''
+        if not self.targeted_documents.strip():
+            return None
+        prefix = corpus.annis_corpus_name + '/'
+        return set(line.strip()[len(prefix):] for line in self.targeted_documents.splitlines() if line.strip().startswith(prefix))
+
+    def add_to_counts(self, texts=0, corpora=0):
+        ''' Add to the ingested counts in the database, without overwriting fields that the worker updates '''
+        Ingest.objects.filter(id=self.id).update(
+            num_texts_ingested=models.F('num_texts_ingested') + texts,
+            num_corpora_ingested=models.F('num_corpora_ingested') + corpora,
+            modified=datetime.datetime.today())
+
+class IngestDocument(models.Model):
+    """
+    Checkpoint of the progress of an ingest on one document, so that an
+    interrupted ingest can be resumed without redoing finished work
+
+    """
+    ingest                  = models.ForeignKey(Ingest, related_name='documents')
+    corpus                  = models.ForeignKey(Corpus)
+    title                   = models.CharField(max_length=200)
+    text                    = models.ForeignKey('texts.Text', null=True, blank=True, on_delete=models.SET_NULL)
+    metadata_done           = models.BooleanField(default=False)
+    visualizations_done     = models.ManyToManyField(HtmlVisualizationFormat, blank=True)
+    rss_delta_kb            = models.IntegerField(default=0, editable=False,
+        help_text='Approximate growth in kB of the resident memory of the worker and its browsers while ingesting '
+        'the document. It includes the growth from the other documents being ingested at the same time, so compare '
+        'the ingest timings of each corpus instead.')
+
+    class Meta:
+        unique_together = ('ingest', 'corpus', 'title')
+
+    def __str__(self):
+        return self.title
+
+    def is_complete(self, formats):
+        ''' Whether the metadata and each of the visualization formats have been ingested '''
+        done_format_ids = set(f.id for f in self.visualizations_done.all())
+        return bool(self.metadata_done and self.text_id) and all(f.id in done_format_ids for f in formats)
+
+
+class IngestTiming(models.Model):
+    """
+    How long one phase of an ingest took, over one corpus, or over all
+    corpora when corpus is empty
+
+    """
+    ingest                  = models.ForeignKey(Ingest, related_name='timings')
+    corpus                  = models.ForeignKey(Corpus, null=True, blank=True)
+    phase                   = models.CharField(max_length=200)
+    count                   = models.PositiveIntegerField()
+    total                   = models.FloatField(help_text='Seconds')
+    p50                     = models.FloatField(help_text='Seconds')
+    p95                     = models.FloatField(help_text='Seconds')
+    max                     = models.FloatField(help_text='Seconds')
+    peak_rss_kb             = models.PositiveIntegerField(help_text='Peak resident memory in kB, of the worker plus its largest finished child process')
+    rss_delta_kb            = models.IntegerField(default=0,
+        help_text='Total growth in kB of the resident memory of the worker and its browsers during the phase')
+
+    class Meta:
+        ordering = ('corpus', '-total')
+
+    def __str__(self):
+        return self.phase
+
+
+class CorpusLock(models.Model):
+    """
+    Advisory lock on a corpus, held by the running ingest that writes its
+    texts, for as long as it keeps the heartbeat fresh
+
+    """
+    corpus                  = models.OneToOneField(Corpus, related_name='ingest_lock')
+    ingest                  = models.ForeignKey(Ingest, related_name='corpus_locks')
+    worker                  = models.CharField(max_length=200, blank=True)
+    token                   = models.CharField(max_length=200, editable=False,
+        help_text='Identifies the run of the ingest that holds the lock')
+    acquired                = models.DateTimeField()
+    heartbeat               = models.DateTimeField(editable=False,
+        help_text='Refreshed while the lock is held. A lock older than INGEST_STALE_SECONDS is taken over.')
+
+    def __str__(self):
+        return '%s locked by %s' % (self.corpus, self.worker or self.ingest)
+
 
 class ExpireIngest(models.Model):
     """
-    Model for expiring ingests
+    Model for expiring ingests. Expires all texts, or only those of the
+    corpus or the ingest given.
 
     """
     created = models.DateTimeField(editable=False)
     modified = models.DateTimeField(editable=False)
+    corpus = models.ForeignKey(Corpus, null=True, blank=True, help_text='Only expire the texts of this corpus')
+    ingest = models.ForeignKey(Ingest, null=True, blank=True, help_text='Only expire the texts this ingest created')
 
     def __str__(self):
         return self.created.strftime('%H:%S %d.%b.%Y')
@@ -56,4 +169,5 @@ class ExpireIngest(models.Model):
         ExpireIngest.objects.all().delete()
 
         super(ExpireIngest, self).save(*args, **kwargs)
-        expire_ingest(self.id)
+        expired = expire_ingest(self)
+        logger.info(" -- Ingest: Expired %d texts" % expired)
@@ -0,0 +1,101 @@
+'''Backing off from a server under pressure: delays between retries, and a circuit breaker per server that
+stops requests to it while it is failing and probes it before letting them resume.'''
+
+import logging
+import random
+import threading
+from time import time
+from urllib.parse import urlsplit
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def backoff_delay(attempt):
+	'''Seconds to wait before retry number attempt, counting from 1: exponential, capped, and with full jitter
+	so that the workers of an ingest don't retry in step'''
+	base = getattr(settings, 'INGEST_BACKOFF_BASE_SECONDS', 1)
+	cap = getattr(settings, 'INGEST_BACKOFF_MAX_SECONDS', 60)
+	return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def circuit_breaker(url):
+	'The circuit breaker of the server of the url, shared by every thread of the process'
+	host = urlsplit(url).netloc
+	with _breakers_lock:
+		if host not in _breakers:
+			_breakers[host] = CircuitBreaker(host)
+		return _breakers[host]
+
+
+class CircuitBreaker:
+	'''After INGEST_BREAKER_FAILURES consecutive failures of a server, the circuit opens and requests wait.
+	After INGEST_BREAKER_RESET_SECONDS one request is let through as a probe. If it succeeds the circuit
+	closes, and if it fails the circuit opens again for twice as long, up to INGEST_BREAKER_MAX_RESET_SECONDS.
+	After INGEST_BREAKER_GIVE_UP_SECONDS the requests waiting are given up and the circuit closes, so that later
+	requests try the server again.'''
+
+	def __init__(self, name):
+		self.name = name
+		self.failure_threshold = getattr(settings, 'INGEST_BREAKER_FAILURES', 5)
+		self.reset_seconds = getattr(settings, 'INGEST_BREAKER_RESET_SECONDS', 5)
+		self.max_reset_seconds = getattr(settings, 'INGEST_BREAKER_MAX_RESET_SECONDS', 300)
+		self.give_up_seconds = getattr(settings, 'INGEST_BREAKER_GIVE_UP_SECONDS', 30 * 60)
+		self._condition = threading.Condition()
+		self._failures = 0
+		self._opened_at = None  # None while the circuit is closed
+		self._down_since = None
+		self._reset = self.reset_seconds
+		self._probe_started = None
+		self._give_ups = 0
+
+	def wait(self):
+		'''Wait until a request to the server may be made. Return False if the server had been failing for
+		longer than INGEST_BREAKER_GIVE_UP_SECONDS while waiting.'''
+		with self._condition:
+			give_ups = self._give_ups
+			while self._opened_at is not None:
+				now = time()
+				if now - self._down_since > self.give_up_seconds:
+					logger.warning('Giving up on %s after %d s. Closing its circuit.' % (self.name, now - self._down_since))
+					self._close()
+					self._give_ups += 1
+					return False
+
+				# A probe that recorded neither success nor failure is abandoned after the longest reset
+				probing = self._probe_started and now - self._probe_started < self.max_reset_seconds
+				remaining = self._opened_at + self._reset - now
+				if remaining <= 0 and not probing:
+					logger.info('Probing %s' % self.name)
+					self._probe_started = now
+					return True
+				self._condition.wait(remaining if remaining > 0 else self._reset)
+			# Requests that were waiting when the circuit was given up are given up with it
+			return self._give_ups == give_ups
+
+	def record_success(self):
+		with self._condition:
+			if self._opened_at is not None:
+				logger.info('%s is responding again. Closing its circuit.' % self.name)
+			self._close()
+
+	def _close(self):
+		self._failures = 0
+		self._opened_at = self._down_since = self._probe_started = None
+		self._reset = self.reset_seconds
+		self._condition.notify_all()
+
+	def record_failure(self):
+		with self._condition:
+			self._failures += 1
+			if self._probe_started:
+				self._probe_started = None
+				self._opened_at = time()
+				self._reset = min(self._reset * 2, self.max_reset_seconds)
+				logger.warning('Probe of %s failed. Waiting %d s.' % (self.name, self._reset))
+			elif self._opened_at is None and self._failures >= self.failure_threshold:
+				self._opened_at = self._down_since = time()
+				logger.warning('%s failed %d times in a row. Waiting %d s.' % (self.name, self._failures, self._reset))
+			self._condition.notify_all()
@@ -0,0 +1,126 @@
+'''Post-processing of captured visualization HTML, in a single pass of an HTML parser: scripts, comments,
+event handler and empty attributes are removed, whitespace is collapsed and CSS is minified.'''
+
+import re
+from html import escape
+from html.parser import HTMLParser
+
+PRESERVE_WHITESPACE_TAGS = ('pre', 'textarea')
+EMPTY_DROPPED_ATTRIBUTES = ('class', 'style', 'id', 'title')
+URL_ATTRIBUTES = ('href', 'src', 'action')
+
+_whitespace = re.compile(r'\s+')
+# CSS strings are kept as they are, and comments, whitespace and final semicolons are removed around them
+_css_token = re.compile(r'''("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|(/\*.*?\*/)|([^"'/]+|/)''', re.DOTALL)
+_css_space = re.compile(r'\s*([{};,>])\s*')
+_css_colon_space = re.compile(r'\s*:\s*')
+_css_brace = re.compile(r'([{}])')
+
+
+def sanitize(html):
+	'Return the sanitized HTML, and the number of bytes of UTF-8 it saved'
+	parser = _Sanitizer()
+	parser.feed(html)
+	parser.close()
+	sanitized = ''.join(parser.out)
+	return sanitized, len(html.encode('utf-8')) - len(sanitized.encode('utf-8'))
+
+
+def minify_css(css, declarations=False):
+	'''Minify a stylesheet, or the declarations of a style attribute. Spaces around colons are only removed
+	in declarations, since in a selector they separate an element from a pseudo-class of its descendant.'''
+	out = []
+	depth = 1 if declarations else 0
+	for string, comment, code in _css_token.findall(css):
+		if string:
+			out.append(string)
+		elif code:
+			parts = _css_brace.split(_whitespace.sub(' ', code))
+			for i, part in enumerate(parts):
+				if part == '{':
+					depth += 1
+				elif part == '}':
+					depth -= 1
+				elif depth > 0:
+					parts[i] = _css_colon_space.sub(':', part)
+			out.append(_css_space.sub(r'\1', ''.join(parts)).replace(';}', '}'))
+	minified = ''.join(out).strip()
+	return minified.rstrip(';') if declarations else minified
+
+
+class _Sanitizer(HTMLParser):
+
+	def __init__(self):
+		super(_Sanitizer, self).__init__(convert_charrefs=False)  # Entities are passed through untouched
+		self.out = []
+		self._in_script = False
+		self._in_style = False
+		self._preserve_whitespace = 0
+
+	def handle_starttag(self, tag, attrs):
+		self._start(tag, attrs, '>')
+
+	def handle_startendtag(self, tag, attrs):
+		self._start(tag, attrs, '/>')
+
+	def _start(self, tag, attrs, end):
+		if tag == 'script':
+			self._in_script = end == '>'
+			return
+		if tag == 'style':
+			self._in_style = end == '>'
+		if tag in PRESERVE_WHITESPACE_TAGS and end == '>':
+			self._preserve_whitespace += 1
+
+		self.out.append('<' + tag)
+		for name, value in attrs:
+			if name.startswith('on'):
+				continue  # Event handlers can't run without the scripts
+			if value is None:
+				self.out.append(' ' + name)
+				continue
+			if name == 'style':
+				value = minify_css(value, declarations=True)
+			if not value and name in EMPTY_DROPPED_ATTRIBUTES:
+				continue
+			if name in URL_ATTRIBUTES and value.strip().lower().startswith('javascript:'):
+				continue
+			self.out.append(' %s="%s"' % (name, escape(value)))
+		self.out.append(end)
+
+	def handle_endtag(self, tag):
+		if tag == 'script':
+			self._in_script = False
+			return
+		if tag == 'style':
+			self._in_style = False
+		if tag in PRESERVE_WHITESPACE_TAGS and self._preserve_whitespace:
+			self._preserve_whitespace -= 1
+		self.out.append('</%s>' % tag)
+
+	def handle_data(self, data):
+		if self._in_script:
+			return
+		if self._in_style:
+			self.out.append(minify_css(data))
+		elif self._preserve_whitespace:
+			self.out.append(data)
+		else:
+			self.out.append(_whitespace.sub(' ', data))
+
+	def handle_entityref(self, name):
+		if not self._in_script:
+			self.out.append('&%s;' % name)
+
+	def handle_charref(self, name):
+		if not self._in_script:
+			self.out.append('&#%s;' % name)
+
+	def handle_decl(self, decl):
+		self.out.append('<!%s>' % decl)
+
+	def handle_pi(self, data):
+		self.out.append('<?%s>' % data)
+
+	def handle_comment(self, data):
+		pass
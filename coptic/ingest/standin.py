@@ -0,0 +1,134 @@
+'''A stand-in for the ANNIS server, serving synthetic corpora at the same URLs, so that an ingest can be
+run and measured without the real server. Used by the ingest_benchmark command.'''
+
+import hashlib
+import logging
+import re
+import threading
+import zlib
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from time import sleep
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+# The paths of the real server, as in scripts/helper.py
+CORPUS_DOCNAME_URL = 'annis-service/annis/meta/docnames/:corpus_name'
+DOCUMENT_METADATA_URL = 'annis-service/annis/meta/doc/:corpus_name/:document_name'
+HTML_VISUALIZATION_URL = 'annis/embeddedvis/htmldoc/:corpus_name/:document_name?config=:html_visualization_format'
+
+
+class StandinAnnisServer(ThreadingMixIn, HTTPServer):
+	'''Serves corpora of the given names, each of documents documents. Each document has meta_fields
+	metadata fields besides its title and URN, and a visualization of about vis_bytes bytes in every
+	format asked for. Every response is delayed by latency seconds.'''
+	daemon_threads = True
+
+	def __init__(self, corpus_names, documents=10, meta_fields=20, vis_bytes=20000, latency=0.0,
+			host='127.0.0.1', port=0):
+		HTTPServer.__init__(self, (host, port), _Handler)
+		self.corpus_names = list(corpus_names)
+		self.documents = documents
+		self.meta_fields = meta_fields
+		self.vis_bytes = vis_bytes
+		self.latency = latency
+		self._thread = None
+
+	@property
+	def base_domain(self):
+		return 'http://%s:%d/' % self.server_address[:2]
+
+	def annis_server(self):
+		'An unsaved AnnisServer for this server'
+		from annis.models import AnnisServer
+		return AnnisServer(title='Stand-in ANNIS server', base_domain=self.base_domain,
+			corpus_docname_url=CORPUS_DOCNAME_URL, document_metadata_url=DOCUMENT_METADATA_URL,
+			html_visualization_url=HTML_VISUALIZATION_URL)
+
+	def start(self):
+		self._thread = threading.Thread(target=self.serve_forever, name='standin-annis')
+		self._thread.daemon = True
+		self._thread.start()
+		logger.info('Stand-in ANNIS server listening at %s' % self.base_domain)
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+		self._thread.join()
+
+	def document_names(self, corpus_name):
+		return ['%s.%04d' % (corpus_name, i) for i in range(self.documents)]
+
+	def docnames_xml(self, corpus_name):
+		# As ANNIS does, each document name is the name of an annotation
+		return _annotations_xml((name, '') for name in self.document_names(corpus_name))
+
+	def metadata_xml(self, corpus_name, document_name):
+		fields = [
+			('title', document_name),
+			('document_cts_urn', 'urn:cts:copticLit:%s' % document_name.lower())]
+		# Few distinct values, as in real corpora, where most documents share authors, editors and so on
+		fields += [('field_%d' % i, 'Value %d of field %d' % (zlib.crc32(document_name.encode()) % 4, i)) for i in range(self.meta_fields)]
+		return _annotations_xml(fields)
+
+	def visualization_html(self, corpus_name, document_name, vis_format):
+		words = []
+		length = 0
+		while length < self.vis_bytes:
+			word = '<span class="norm" title="%s">%s_%d</span> ' % (vis_format, document_name, len(words))
+			words.append(word)
+			length += len(word)
+		return ('<html><head><style>.norm { color: #333; }</style><script>var vis = "%s";</script></head>'
+			'<body><div class="htmlvis">%s</div></body></html>') % (vis_format, ''.join(words))
+
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'  # Keep-alive, as the real server
+
+	routes = [
+		(re.compile('^/' + CORPUS_DOCNAME_URL.replace(':corpus_name', '([^/]+)') + '$'), 'docnames_xml', 'text/xml'),
+		(re.compile('^/' + DOCUMENT_METADATA_URL.replace(':corpus_name', '([^/]+)').replace(':document_name', '([^/]+)') + '$'),
+			'metadata_xml', 'text/xml'),
+		(re.compile('^/' + HTML_VISUALIZATION_URL.split('?')[0].replace(':corpus_name', '([^/]+)').replace(':document_name', '([^/]+)') + '$'),
+			'visualization_html', 'text/html'),
+	]
+
+	def do_GET(self):
+		sleep(self.server.latency)
+		url = urlsplit(self.path)
+		for pattern, method, content_type in self.routes:
+			match = pattern.match(url.path)
+			if match:
+				args = [unquote(group) for group in match.groups()]
+				if method == 'visualization_html':
+					args.append(parse_qs(url.query).get('config', [''])[0])
+				if args[0] in self.server.corpus_names:
+					return self._respond(getattr(self.server, method)(*args).encode('utf-8'), content_type)
+		self.send_error(404)
+
+	def _respond(self, body, content_type):
+		etag = '"%s"' % hashlib.sha1(body).hexdigest()
+		if self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.send_header('ETag', etag)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+
+		self.send_response(200)
+		self.send_header('Content-Type', content_type + '; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		self.send_header('ETag', etag)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		logger.debug(format % args)
+
+
+def _annotations_xml(name_value_pairs):
+	return '<?xml version="1.0" encoding="UTF-8"?><annotations>%s</annotations>' % ''.join(
+		'<annotation><namespace>annis</namespace><name>%s</name><value>%s</value></annotation>' % (escape(name), escape(value))
+		for name, value in name_value_pairs)
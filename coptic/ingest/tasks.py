@@ -1,5 +1,98 @@
+'Database-backed queue of ingest jobs, worked by the ingest_worker management command'
+
+import datetime
+import logging
+import os
+import socket
 import threading
+import traceback
+from django.conf import settings
+from django.db import connection
 from ingest.ingest import fetch_texts
+from ingest.memory import MemoryBudgetExceeded
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name():
+	return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def claim_next_ingest(worker):
+	'''Mark the oldest queued ingest that shares no corpus with a running ingest as running on this worker,
+	and return it. Return None if there is no such ingest.'''
+	from ingest.models import Ingest
+	requeue_stale_ingests()
+
+	busy_corpus_ids = set(Ingest.objects.filter(status=Ingest.RUNNING).values_list('corpora', flat=True))
+	for ingest in Ingest.objects.filter(status=Ingest.QUEUED).order_by('created'):
+		if busy_corpus_ids & set(ingest.corpora.values_list('id', flat=True)):
+			continue
+
+		now = datetime.datetime.today()
+		# Only one worker's update can find the ingest still queued
+		claimed = Ingest.objects.filter(id=ingest.id, status=Ingest.QUEUED).update(
+			status=Ingest.RUNNING, worker=worker, heartbeat=now, started=now, finished=None, error='')
+		if claimed:
+			logger.info('%s claimed ingest %d' % (worker, ingest.id))
+			return Ingest.objects.get(id=ingest.id)
+
+	return None
+
+
+def requeue_stale_ingests():
+	'Queue again the running ingests whose worker has stopped sending heartbeats'
+	from ingest.models import Ingest
+	stale_before = datetime.datetime.today() - datetime.timedelta(seconds=getattr(settings, 'INGEST_STALE_SECONDS', 300))
+	requeued = Ingest.objects.filter(status=Ingest.RUNNING, heartbeat__lt=stale_before).update(status=Ingest.QUEUED)
+	if requeued:
+		logger.warning('Requeued %d ingests whose workers stopped' % requeued)
+
+
+def run_ingest(ingest_id, worker):
+	'''Run a claimed ingest, sending heartbeats while it runs, and record how it ended. Return True if the
+	worker went over its memory budget, in which case the ingest is queued again and the worker process
+	should exit, so that a new one resumes the ingest.'''
+	from ingest.models import Ingest
+	heartbeat = _Heartbeat(ingest_id, worker)
+	heartbeat.start()
+	status, error = Ingest.DONE, ''
+
+	try:
+		fetch_texts(ingest_id)
+	except MemoryBudgetExceeded as e:
+		logger.warning('Queueing ingest %d again: %s' % (ingest_id, e))
+		status = Ingest.QUEUED
+	except Exception:
+		logger.exception('Ingest %d failed' % ingest_id)
+		status, error = Ingest.FAILED, traceback.format_exc()
+	finally:
+		heartbeat.stop()
+
+	requeued = status == Ingest.QUEUED
+	Ingest.objects.filter(id=ingest_id, worker=worker).update(
+		status=status, error=error, finished=None if requeued else datetime.datetime.today())
+	return requeued
+
+
+class _Heartbeat(threading.Thread):
+	'Periodically record that the worker running an ingest is alive'
+
+	def __init__(self, ingest_id, worker):
+		super(_Heartbeat, self).__init__(name='ingest-heartbeat')
+		self.daemon = True
+		self.ingest_id = ingest_id
+		self.worker = worker
+		self._stopped = threading.Event()
+
+	def run(self):
+		from ingest.models import Ingest
+		try:
+			while not self._stopped.wait(getattr(settings, 'INGEST_HEARTBEAT_SECONDS', 30)):
+				Ingest.objects.filter(id=self.ingest_id, worker=self.worker).update(heartbeat=datetime.datetime.today())
+		finally:
+			connection.close()
 
-def ingest_asynch( ingest_id ):
-    threading.Thread(target=fetch_texts, args=(ingest_id,)).start()
+	def stop(self):
+		self._stopped.set()
+		self.join()
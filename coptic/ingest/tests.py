@@ -0,0 +1,94 @@
+import json
+from unittest import mock
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test.utils import override_settings
+from ingest.ingest import fetch_texts
+from ingest.management.commands.ingest_benchmark import _create_corpora
+from ingest.models import Ingest, CorpusLock
+from ingest.retry import CircuitBreaker
+from ingest.standin import StandinAnnisServer
+from texts.models import Text
+
+class IngestTestCase(TransactionTestCase):
+	# Visualizations are saved from other threads, which must see the ingest's rows
+	@override_settings(INGEST_CACHE_DIR=None)
+	def test_ingest_from_standin(self):
+		print(" -- testing an ingest from a stand-in ANNIS server")
+		standin = StandinAnnisServer(['test.corpus'], documents=3, meta_fields=2, vis_bytes=1000)
+		standin.start()
+		try:
+			ingest = Ingest.objects.create(vis_workers=2)
+			ingest.corpora.add(*_create_corpora(['test.corpus'], 1))
+			fetch_texts(ingest.id, standin.annis_server())
+		finally:
+			standin.stop()
+
+		texts = Text.objects.live().filter(ingest=ingest)
+		self.assertEqual(texts.count(), 3)
+		for text in texts:
+			self.assertEqual(text.text_meta.count(), 4)
+			self.assertEqual(text.html_visualizations.count(), 1)
+			vis = text.html_visualizations.get()
+			self.assertNotIn('<script', vis.html)
+			self.assertNotIn('<style', vis.html)
+			self.assertEqual(vis.stylesheet.css, '.norm{color:#333}')
+
+	@override_settings(INGEST_CACHE_DIR=None)
+	def test_ingest_corpora_in_processes(self):
+		print(" -- testing an ingest of corpora in parallel processes")
+		corpus_names = ['test.corpus1', 'test.corpus2']
+		standin = StandinAnnisServer(corpus_names, documents=2, meta_fields=2, vis_bytes=1000)
+		standin.start()
+		try:
+			ingest = Ingest.objects.create(vis_workers=1, corpus_processes=2)
+			ingest.corpora.add(*_create_corpora(corpus_names, 1))
+			fetch_texts(ingest.id, standin.annis_server())
+		finally:
+			standin.stop()
+
+		for corpus_name in corpus_names:
+			self.assertEqual(Text.objects.live().filter(ingest=ingest, corpus__annis_corpus_name=corpus_name).count(), 2)
+		self.assertEqual(ingest.timings.filter(corpus__annis_corpus_name__in=corpus_names, phase='document names').count(), 2)
+		self.assertFalse(CorpusLock.objects.exists())
+
+	@override_settings(INGEST_CACHE_DIR=None)
+	def test_targeted_ingest_and_dry_run(self):
+		print(" -- testing a targeted ingest and a dry run")
+		standin = StandinAnnisServer(['test.corpus'], documents=3, meta_fields=2, vis_bytes=1000)
+		standin.start()
+		try:
+			corpora = _create_corpora(['test.corpus'], 1)
+			titles = standin.document_names('test.corpus')
+			ingest = Ingest.objects.create(vis_workers=1, targeted_documents='test.corpus/%s\ntest.corpus/%s' % tuple(titles[:2]))
+			ingest.corpora.add(*corpora)
+			fetch_texts(ingest.id, standin.annis_server())
+
+			dry_run = Ingest.objects.create(dry_run=True)
+			dry_run.corpora.add(*corpora)
+			fetch_texts(dry_run.id, standin.annis_server())
+		finally:
+			standin.stop()
+
+		self.assertEqual(sorted(Text.objects.live().values_list('title', flat=True)), sorted(titles[:2]))
+		diff = json.loads(Ingest.objects.get(id=dry_run.id).diff)
+		self.assertEqual(diff['test.corpus']['added'], titles[2:])
+		self.assertEqual(diff['test.corpus']['removed'], [])
+		self.assertEqual(diff['test.corpus']['changed'], {})
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+	@override_settings(INGEST_BREAKER_FAILURES=2, INGEST_BREAKER_GIVE_UP_SECONDS=60)
+	def test_server_recovering_after_give_up(self):
+		print(" -- testing a circuit breaker letting requests through again after giving up")
+		clock = [1000.0]
+		with mock.patch('ingest.retry.time', lambda: clock[0]):
+			breaker = CircuitBreaker('annis')
+			breaker.record_failure()
+			breaker.record_failure()
+			clock[0] += 61
+			self.assertFalse(breaker.wait())
+
+			# The server has recovered, and the next request tries it
+			self.assertTrue(breaker.wait())
+			breaker.record_success()
+			self.assertTrue(breaker.wait())
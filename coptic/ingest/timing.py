@@ -0,0 +1,90 @@
+'Timing of the phases of an ingest, by corpus, saved as IngestTiming rows'
+
+import math
+import resource
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from time import time
+
+
+class PhaseTimer:
+	'''Collects the durations of the phases of an ingest (fetching document names, fetching metadata,
+	each visualization format, and so on) from any thread, along with the peak memory use seen and
+	the memory growth recorded for each phase.'''
+
+	def __init__(self):
+		self._durations = defaultdict(list)  # By (corpus, phase)
+		self._peak_rss = defaultdict(int)
+		self._rss_delta = defaultdict(int)
+		self._lock = threading.Lock()
+
+	@contextmanager
+	def time(self, corpus, phase):
+		start = time()
+		try:
+			yield
+		finally:
+			self.record(corpus, phase, time() - start)
+
+	def record(self, corpus, phase, seconds):
+		rss = peak_rss_kb()
+		with self._lock:
+			self._durations[(corpus, phase)].append(seconds)
+			self._peak_rss[(corpus, phase)] = max(self._peak_rss[(corpus, phase)], rss)
+
+	def record_memory(self, corpus, phase, rss_delta_kb):
+		with self._lock:
+			self._rss_delta[(corpus, phase)] += rss_delta_kb
+
+	def export(self):
+		'The timings recorded, as plain data that can be sent to another process and merged into its timer'
+		with self._lock:
+			return dict(self._durations), dict(self._peak_rss), dict(self._rss_delta)
+
+	def merge(self, exported):
+		durations, peak_rss, rss_delta = exported
+		with self._lock:
+			for key, seconds in durations.items():
+				self._durations[key].extend(seconds)
+			for key, rss in peak_rss.items():
+				self._peak_rss[key] = max(self._peak_rss[key], rss)
+			for key, kb in rss_delta.items():
+				self._rss_delta[key] += kb
+
+	def save(self, ingest):
+		'''Replace the timings of the ingest with a row for each corpus and phase, and a row for each phase
+		over all corpora'''
+		from ingest.models import IngestTiming
+
+		with self._lock:
+			durations = dict(self._durations)
+			peak_rss = dict(self._peak_rss)
+			rss_delta = defaultdict(int, self._rss_delta)
+
+		totals = defaultdict(list)
+		total_peak_rss = defaultdict(int)
+		for (corpus, phase), seconds in durations.items():
+			if corpus:
+				totals[(None, phase)].extend(seconds)
+				total_peak_rss[(None, phase)] = max(total_peak_rss[(None, phase)], peak_rss[(corpus, phase)])
+				rss_delta[(None, phase)] += rss_delta[(corpus, phase)]
+		durations.update(totals)
+		peak_rss.update(total_peak_rss)
+
+		IngestTiming.objects.filter(ingest=ingest).delete()
+		IngestTiming.objects.bulk_create([IngestTiming(
+			ingest=ingest, corpus=corpus, phase=phase, count=len(seconds), total=sum(seconds),
+			p50=percentile(seconds, 50), p95=percentile(seconds, 95), max=max(seconds),
+			peak_rss_kb=peak_rss[(corpus, phase)], rss_delta_kb=rss_delta[(corpus, phase)]) for (corpus, phase), seconds in durations.items()])
+
+
+def percentile(values, p):
+	'The nearest-rank percentile of the values'
+	ordered = sorted(values)
+	return ordered[max(0, int(math.ceil(p / 100 * len(ordered))) - 1)]
+
+
+def peak_rss_kb():
+	'The peak resident memory of this process plus that of its largest finished child, such as a browser'
+	return sum(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
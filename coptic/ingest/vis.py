@@ -1,95 +1,351 @@
-import re
-import os
 import logging
+import queue
+import threading
 from time import time, sleep
 import resource
-from selenium import webdriver
+import requests
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from texts.models import HtmlVisualization
+from xvfbwrapper import Xvfb
+from ingest.browser import BrowserSession
+from ingest.cache import CacheMiss
+from ingest.client import default_client
+from ingest.memory import tree_rss_kb
+from ingest.retry import backoff_delay, circuit_breaker
+from ingest.sanitize import sanitize, minify_css
+from ingest.timing import PhaseTimer
 
 logger = logging.getLogger(__name__)
 MAX_VIS_TRIES = 5
+SERVER_BUSY_STATUSES = (429, 500, 502, 503, 504)
+NOT_MODIFIED = object()  # The server reported that the stored visualization is current
 
 
-def collect(corpus, text, annis_server):
-	corpus_name = corpus.annis_corpus_name
+def collect(corpus, text, pool, document=None, previous_text=None):
+	'''Queue a fetch of every visualization format of the corpus for the text. If an ingest checkpoint
+	document is given, skip the formats it has done, and record each format on it when done. If the
+	previous text of the document is given, reuse its visualizations that haven't changed.'''
 	formats = corpus.html_visualization_formats.all()
-	logger.info('Fetching %d visualizations' % len(formats))
-	driver = None
+	if document:
+		done_format_ids = set(f.id for f in document.visualizations_done.all())
+		formats = [f for f in formats if f.id not in done_format_ids]
+	logger.info('Queueing %d visualizations' % len(formats))
 
 	for html_format in formats:
-		html_vis_url = annis_server.url_html_visualization(corpus_name, text.title, html_format.slug)
+		pool.submit(corpus, text, html_format, document, previous_text)
 
-		vis_tries_left = MAX_VIS_TRIES
-		text_html = False
 
-		while not text_html and vis_tries_left:
-			try:
-				if not driver:
-					logger.debug("Starting browser")
-					try:
-						driver = webdriver.Chrome(os.environ.get('CHROMEDRIVER', '/usr/lib/chromium-browser/chromedriver'))
-					except Exception as e:
-						logger.error('Unable to start browser: %s' % e)
-						return
-					logger.debug(driver)
-
-				logger.info(html_format.title)
-				retries_left = 5
-				connection_accepted = False
-				vis_fetch_start_time = time()
-				while not connection_accepted and retries_left:
-					try:
-						driver.get(html_vis_url)
-						connection_accepted = True
-					except ConnectionRefusedError as cre:
-						logger.warning(cre)
-						retries_left -= 1
-						sleep(15)
-
-				if retries_left == 0:
-					raise VisServerRefusingConn()
-
-				logger.info('Calling WebDriverWait')
-				WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.CLASS_NAME, "htmlvis")))
-				text_html = driver.find_element_by_xpath("/html/body").get_attribute("innerHTML")
-				logger.info('WebDriverWait returned\t%s\t%s\t%s\t%d\t%d\t%f' % (
-					corpus_name, text.title, html_format.slug, len(text_html),
-					MAX_VIS_TRIES - vis_tries_left, time() - vis_fetch_start_time))
-				driver.delete_all_cookies()
-
-			except Exception as e:
-				vis_tries_left -= 1
-				logger.error('Error getting %s: %s' % (html_vis_url, e))
-				logger.error('Page source: ' + driver.page_source)
-				driver.quit()
-				driver = None
+class VisWorkerPool:
+	'''A pool of workers that take (corpus, text, format) jobs from a shared queue. Visualizations are
+	fetched over plain HTTP where possible. Each worker starts a headless browser session the first
+	time it gets a visualization that needs JavaScript, and keeps it for the life of the pool.'''
+
+	def __init__(self, annis_server, size=None, client=None, timer=None):
+		self.annis_server = annis_server
+		self.client = client or default_client()
+		self.timer = timer or PhaseTimer()
+		self.size = max(1, size or getattr(settings, 'INGEST_VIS_WORKERS', 1))
+		self._jobs = queue.Queue()
+		self._workers = []
+		self._error = None
+		self._failed = []  # Jobs to try once more at the end of the run
+		self._browsers = []
+		self._stylesheets = {}  # By format id and fingerprint
+		self._stylesheets_lock = threading.Lock()
+		self._display = None
+		self._display_lock = threading.Lock()
+
+	def start(self):
+		logger.info('Starting %d visualization workers' % self.size)
+		for i in range(self.size):
+			worker = threading.Thread(target=self._work, name='vis-worker-%d' % i)
+			worker.daemon = True
+			worker.start()
+			self._workers.append(worker)
+
+	def submit(self, corpus, text, html_format, document=None, previous_text=None):
+		self._raise_if_failed()
+		self._jobs.put((corpus, text, html_format, document, previous_text))
+
+	def join(self):
+		'''Wait for the queued jobs to finish, then try the jobs that failed once more, now that the server
+		has had time to recover. Stop the workers, and raise any error that stopped a worker.'''
+		self._jobs.join()
+		failed, self._failed = self._failed, []
+		if failed and not self._error:
+			logger.info('Retrying %d visualizations that failed' % len(failed))
+			for job in failed:
+				self._jobs.put(job)
+			self._jobs.join()
+			if self._failed:
+				logger.warning('%d visualizations failed again. Resuming the ingest will retry them.' % len(self._failed))
+
+		self.stop()
+		self._raise_if_failed()
+
+	def recycle_browsers(self):
+		'Wait for the queued jobs to finish, then quit the browsers. Workers start new ones when they need them.'
+		self._jobs.join()
+		for browser in self._browsers:  # Every worker is waiting for a job, so none is using its browser
+			browser.quit()
+		logger.info('Quit %d browsers to free memory' % len(self._browsers))
+
+	def stop(self):
+		'Wait for the queued jobs to finish, and stop the workers'
+		for _ in self._workers:
+			self._jobs.put(None)
+		for worker in self._workers:
+			worker.join()
+		self._workers = []
+
+		if self._display:
+			self._display.stop()
+			self._display = None
+
+	def _raise_if_failed(self):
+		if self._error:
+			raise self._error
 
-		if not text_html:
+	def _work(self):
+		browser = BrowserSession(self._start_display)
+		self._browsers.append(browser)
+		try:
+			while True:
+				job = self._jobs.get()
+				try:
+					if job is None:
+						break
+					if self._error:  # Another worker gave up on the server. Drain the queue.
+						continue
+					rss_before = tree_rss_kb()
+					if not self._collect_one(browser, *job):
+						self._failed.append(job)
+					self._record_memory(tree_rss_kb() - rss_before, *job)
+				except VisServerRefusingConn as e:
+					self._error = e
+				except Exception:
+					logger.exception('Error collecting a visualization')
+					self._failed.append(job)
+				finally:
+					self._jobs.task_done()
+		finally:
+			browser.quit()
+			connection.close()  # Each thread has its own database connection
+
+	def _collect_one(self, browser, corpus, text, html_format, document, previous_text):
+		'''Fetch and save one visualization, or reuse that of the previous text if unchanged, and record
+		it on the checkpoint document if any. Return whether it succeeded.'''
+		from texts.models import HtmlVisualization
+		corpus_name = corpus.annis_corpus_name
+		html_vis_url = self.annis_server.url_html_visualization(corpus_name, text.title, html_format.slug)
+		logger.info(html_format.title)
+
+		existing_vis = previous_text.html_visualizations.filter(visualization_format=html_format).first() \
+			if previous_text else None
+		text_html, css, validators = None, '', {}
+		with self.timer.time(corpus, 'visualization ' + html_format.slug):
+			if not html_format.needs_javascript:
+				text_html, css, validators = _fetch_over_http(self.client, html_vis_url, existing_vis)
+				if text_html is None:
+					logger.info('No htmlvis element in %s. Falling back to a browser.' % html_vis_url)
+
+			if text_html is None and self.client.offline:
+				# Pages rendered in a browser are not in the response cache
+				logger.warning('Not rendering %s in a browser while offline' % html_vis_url)
+			elif text_html is None:
+				text_html, css = _fetch_with_browser(browser, html_vis_url, corpus_name, text.title, html_format.slug)
+
+		if text_html is NOT_MODIFIED:
+			logger.info('%s not modified' % html_vis_url)
+			with self.timer.time(corpus, 'database writes'):
+				text.html_visualizations.add(existing_vis)
+		elif not text_html:
 			logger.error('Unable to get %s in %d tries.' % (html_vis_url, MAX_VIS_TRIES))
+			return False
 		else:
-			# Add the styles
-			for style_elem in driver.find_elements_by_xpath("/html/head/style"):
-				text_html += "<style>" + style_elem.get_attribute("innerHTML") + "</style>"
+			with self.timer.time(corpus, 'HTML post-processing'):
+				text_html, bytes_saved = sanitize(text_html)
+				css = minify_css(css)
+				logger.info('Sanitizing %s saved %d bytes' % (html_vis_url, bytes_saved))
+				fingerprint = HtmlVisualization.fingerprint_html(text_html, css)
 
-			# Remove JavaScript elements
-			for script_elem in re.findall(r'<script.*script>', text_html, re.DOTALL):
-				text_html = text_html.replace(script_elem, "")
+			with self.timer.time(corpus, 'database writes'):
+				if existing_vis and existing_vis.fingerprint == fingerprint:
+					logger.info('%s unchanged' % html_vis_url)
+					text.html_visualizations.add(existing_vis)
+				else:
+					vis = HtmlVisualization()
+					vis.visualization_format = html_format
+					vis.html = text_html
+					vis.stylesheet = self._stylesheet(html_format, css)
+					vis.fingerprint = fingerprint
+					vis.etag = validators.get('etag', '')
+					vis.last_modified = validators.get('last_modified', '')
+					vis.save()
 
-			vis = HtmlVisualization()
-			vis.visualization_format = html_format
-			vis.html = text_html
-			vis.save()
+					text.html_visualizations.add(vis)
 
-			text.html_visualizations.add(vis)
+		if document:
+			document.visualizations_done.add(html_format)
 
 		self_max_mem, child_max_mem = [resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
 		logger.info('Max mem, self: {:,}, children: {:,}'.format(self_max_mem, child_max_mem))
+		return True
+
+	def _record_memory(self, rss_delta_kb, corpus, text, html_format, document, previous_text):
+		'''Add the growth in memory of the worker and its browsers during a job to its document and format. Other jobs
+		run at the same time, so the growth of a document is only approximate.'''
+		self.timer.record_memory(corpus, 'visualization ' + html_format.slug, rss_delta_kb)
+		if document:
+			from ingest.models import IngestDocument
+			IngestDocument.objects.filter(id=document.id).update(rss_delta_kb=F('rss_delta_kb') + rss_delta_kb)
+
+	def _stylesheet(self, html_format, css):
+		'The stylesheet of the format with the css, stored the first time it is seen. None if there is no css.'
+		from texts.models import VisualizationStylesheet
+		if not css:
+			return None
+		key = (html_format.id, VisualizationStylesheet.fingerprint_css(css))
+		with self._stylesheets_lock:
+			if key not in self._stylesheets:
+				self._stylesheets[key] = VisualizationStylesheet.objects.get_or_create(
+					visualization_format=html_format, fingerprint=key[1], defaults={'css': css})[0]
+			return self._stylesheets[key]
+
+	def _start_display(self):
+		'Start the virtual framebuffer the first time a browser is needed'
+		with self._display_lock:
+			if not self._display:
+				logger.info("Starting virtual framebuffer")
+				self._display = Xvfb()
+				try:
+					self._display.start()
+				except Exception as e:
+					logger.error('Unable to start Xvfb: %s' % e)
+
+
+def _fetch_with_browser(browser, html_vis_url, corpus_name, title, format_slug):
+	'Render the visualization in the browser session. Return its body HTML and the CSS of its head.'
+	breaker = circuit_breaker(html_vis_url)
+
+	for attempt in range(MAX_VIS_TRIES):
+		if attempt:
+			sleep(backoff_delay(attempt))
+		driver = browser.driver()
+		if not driver:
+			return None, ''
+		if not breaker.wait():
+			raise VisServerRefusingConn()
+
+		try:
+			vis_fetch_start_time = time()
+			try:
+				driver.get(html_vis_url)
+			except ConnectionRefusedError as cre:
+				logger.warning(cre)
+				breaker.record_failure()
+				continue
+			breaker.record_success()
+
+			logger.info('Calling WebDriverWait')
+			WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.CLASS_NAME, "htmlvis")))
+			text_html = driver.find_element_by_xpath("/html/body").get_attribute("innerHTML")
+			logger.info('WebDriverWait returned\t%s\t%s\t%s\t%d\t%d\t%f' % (
+				corpus_name, title, format_slug, len(text_html), attempt, time() - vis_fetch_start_time))
+
+			if text_html:
+				css = '\n'.join(style_elem.get_attribute("innerHTML") for style_elem in driver.find_elements_by_xpath("/html/head/style"))
+				return text_html, css
+
+		except Exception as e:
+			# The session checks the browser's health before the next try, and replaces it if needed
+			logger.error('Error getting %s: %s' % (html_vis_url, e))
+			try:
+				logger.error('Page source: ' + driver.page_source)
+			except Exception:
+				pass
+		finally:
+			browser.page_rendered()
+
+	return '', ''
+
+
+def _fetch_over_http(client, html_vis_url, existing_vis=None):
+	'''Fetch a visualization without a browser. Return its body HTML, or None if the page has no htmlvis
+	element until JavaScript runs, or NOT_MODIFIED if the server says existing_vis is current. Also return
+	the CSS of its head, and the ETag and Last-Modified validators of the response.'''
+	breaker = circuit_breaker(html_vis_url)
+	headers = {}
+	if existing_vis and existing_vis.etag:
+		headers['If-None-Match'] = existing_vis.etag
+	if existing_vis and existing_vis.last_modified:
+		headers['If-Modified-Since'] = existing_vis.last_modified
+
+	for attempt in range(MAX_VIS_TRIES):
+		if attempt:
+			sleep(backoff_delay(attempt))
+		if not breaker.wait():
+			raise VisServerRefusingConn()
+
+		vis_fetch_start_time = time()
+		try:
+			response = client.get(html_vis_url, headers=headers)
+		except CacheMiss as e:
+			logger.error(e)
+			break
+		except (requests.ConnectionError, requests.Timeout) as e:
+			logger.warning('Error getting %s: %s' % (html_vis_url, e))
+			breaker.record_failure()
+			continue
+		if response.status_code in SERVER_BUSY_STATUSES:
+			logger.warning('%s returned HTTP status %d' % (html_vis_url, response.status_code))
+			breaker.record_failure()
+			continue
+		breaker.record_success()
+
+		try:
+			if response.status_code == 304:
+				return NOT_MODIFIED, '', {}
+			if 400 <= response.status_code < 500:
+				logger.error('%s returned HTTP status %d' % (html_vis_url, response.status_code))
+				break  # Trying again won't help
+			response.raise_for_status()
+			validators = {
+				'etag':             response.headers.get('ETag', ''),
+				'last_modified':    response.headers.get('Last-Modified', '')}
+
+			soup = BeautifulSoup(response.content, from_encoding='utf-8')
+			if not soup.find(class_='htmlvis'):
+				return None, '', validators
+
+			if not soup.body:
+				raise VisualizationParseError('%s has no body' % html_vis_url)
+			text_html = ''.join(str(child) for child in soup.body.contents)
+			# Newer versions of BeautifulSoup leave the contents of style elements out of get_text()
+			css = '\n'.join(''.join(str(child) for child in style_elem.contents)
+				for style_elem in soup.head.find_all('style')) if soup.head else ''
+
+			logger.info('HTTP fetch returned\t%s\t%d\t%d\t%f' % (
+				html_vis_url, len(text_html), attempt, time() - vis_fetch_start_time))
+			return text_html, css, validators
+
+		except VisualizationParseError as e:
+			logger.error(e)
+			break  # The same page would fail the same way again
+		except Exception as e:
+			logger.error('Error getting %s: %s' % (html_vis_url, e))
+
+	return '', '', {}
 
-	if driver:
-		driver.quit()
 
 class VisServerRefusingConn(Exception):
 	pass
+
+
+class VisualizationParseError(Exception):
+	pass
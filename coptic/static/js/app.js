@@ -238,12 +238,23 @@ angular.module('coptic')
                         }
                     }
 
+                    function load_visualization_html(visualization) {
+                        if (visualization.html !== undefined) {
+                            return;
+                        }
+                        // Served separately, and compressed for browsers that accept it
+                        $http.get(visualization.html_url, {cache: true}).then(function (response) {
+                            visualization.html = response.data;
+                        });
+                    }
+
                     if (! text) {
                         $location.path("/");
                     } else {
                         $scope.selected_text = text;
                         $scope.filters = [];
                         text.text_meta.forEach(add_properties_from_metadata);
+                        text.html_visualizations.forEach(load_visualization_html);
                         if (vis_code !== undefined) {
                             // This is a kludge coming from my Angular ignorance. Calling show_selected_visualization
                             // synchronously doesn’t work, I presume because the DOM isn’t yet set up as expected. -- dcb
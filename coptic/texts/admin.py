@@ -1,15 +1,29 @@
 from django.contrib import admin
+from texts import probe_github
 from texts.models import Corpus, Text, TextMeta, MetaOrder, SpecialMeta, \
-	HtmlVisualization, HtmlVisualizationFormat
+	HtmlVisualization, HtmlVisualizationFormat, VisualizationStylesheet
 
 class MetaOrderAdmin(admin.ModelAdmin):
 	list_display = ('name', 'order')
 	ordering = ('order', )
 
-admin.site.register(Corpus)
+class CorpusAdmin(admin.ModelAdmin):
+	actions = ['refresh_github_directory_names']
+
+	def refresh_github_directory_names(self, request, queryset):
+		''' List the GitHub repository again, and update the directory names of the corpora from it '''
+		probe_github.clear_cache()
+		for corpus in queryset:
+			corpus.refresh_github_directory_names()
+			corpus.save()
+		self.message_user(request, 'Updated the GitHub directory names of %d corpora' % len(queryset))
+	refresh_github_directory_names.short_description = 'Refresh GitHub directory names of selected corpora'
+
+admin.site.register(Corpus, CorpusAdmin)
 admin.site.register(Text)
 admin.site.register(TextMeta)
 admin.site.register(MetaOrder, MetaOrderAdmin)
 admin.site.register(SpecialMeta)
 admin.site.register(HtmlVisualization)
 admin.site.register(HtmlVisualizationFormat)
+admin.site.register(VisualizationStylesheet)
@@ -0,0 +1,53 @@
+'''Process-local copies of the MetaOrder and SpecialMeta tables, which change only when an admin edits them.
+Saving or deleting a row clears the copies of this process, and changes a version stamp in the Django cache,
+which tells the other processes sharing the cache, configured by CACHES, to reload theirs. The stamp is read
+at most once every META_CONFIG_CHECK_SECONDS, as reading it from a database cache is itself a query.'''
+
+import threading
+from time import time
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_CACHE_KEY = 'texts.meta_config.version'
+_lock = threading.Lock()
+_loaded = None  # Replaced, never changed, so readers may keep it
+
+
+def meta_orders():
+	'The order of each MetaOrder name, by name'
+	return _config()['meta_orders']
+
+
+def special_metas():
+	'The SpecialMeta rows'
+	return _config()['special_metas']
+
+
+def invalidate():
+	global _loaded
+	_loaded = None
+	cache.set(VERSION_CACHE_KEY, uuid4().hex, None)
+
+
+def _config():
+	global _loaded
+	from texts.models import MetaOrder, SpecialMeta
+
+	config = _loaded
+	if config is not None and time() - config['checked'] < getattr(settings, 'META_CONFIG_CHECK_SECONDS', 5):
+		return config
+
+	version = cache.get(VERSION_CACHE_KEY)
+	if version is None:
+		cache.add(VERSION_CACHE_KEY, uuid4().hex, None)
+		version = cache.get(VERSION_CACHE_KEY)
+
+	with _lock:
+		if config is None or config['version'] != version:
+			config = {
+				'version': version,
+				'meta_orders': {mo.name: mo.order for mo in MetaOrder.objects.all()},
+				'special_metas': list(SpecialMeta.objects.all())}
+		_loaded = config = dict(config, checked=time())
+	return config
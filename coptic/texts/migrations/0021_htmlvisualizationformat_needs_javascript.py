@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0020_metaorder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='htmlvisualizationformat',
+            name='needs_javascript',
+            field=models.BooleanField(default=False, help_text='Render with a headless browser instead of fetching the HTML directly'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0021_htmlvisualizationformat_needs_javascript'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='text',
+            name='fingerprint',
+            field=models.CharField(max_length=40, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='htmlvisualization',
+            name='fingerprint',
+            field=models.CharField(max_length=40, blank=True),
+        ),
+        migrations.AddField(
+            model_name='htmlvisualization',
+            name='etag',
+            field=models.CharField(max_length=200, blank=True),
+        ),
+        migrations.AddField(
+            model_name='htmlvisualization',
+            name='last_modified',
+            field=models.CharField(max_length=200, blank=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+from django.db import models, migrations
+
+
+def hash_values_and_merge_duplicates(apps, schema_editor):
+    'Fill in value_hash, and merge TextMeta rows with the same name and value so they can be unique'
+    TextMeta = apps.get_model('texts', 'TextMeta')
+    Text = apps.get_model('texts', 'Text')
+    TextTextMeta = Text.text_meta.through
+    kept_by_key = {}
+
+    for meta in TextMeta.objects.order_by('id').iterator():
+        value_hash = hashlib.sha1(meta.value.encode('utf-8')).hexdigest()
+        kept = kept_by_key.get((meta.name, value_hash))
+
+        if not kept:
+            TextMeta.objects.filter(id=meta.id).update(value_hash=value_hash)
+            kept_by_key[(meta.name, value_hash)] = meta.id
+        else:
+            linked_text_ids = set(TextTextMeta.objects.filter(textmeta_id=kept).values_list('text_id', flat=True))
+            TextTextMeta.objects.bulk_create([
+                TextTextMeta(text_id=text_id, textmeta_id=kept)
+                for text_id in TextTextMeta.objects.filter(textmeta_id=meta.id).values_list('text_id', flat=True)
+                if text_id not in linked_text_ids])
+            meta.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0022_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='textmeta',
+            name='value_hash',
+            field=models.CharField(max_length=40, editable=False, default=''),
+            preserve_default=False,
+        ),
+        migrations.RunPython(hash_values_and_merge_duplicates),
+        migrations.AlterUniqueTogether(
+            name='textmeta',
+            unique_together=set([('name', 'value_hash')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0023_textmeta_value_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='text',
+            name='is_live',
+            field=models.BooleanField(default=True, db_index=True),
+        ),
+    ]
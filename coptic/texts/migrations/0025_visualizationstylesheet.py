@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import re
+from django.db import models, migrations
+import django.db.models.deletion
+
+BATCH_SIZE = 500
+STYLE_ELEMENT = re.compile(r'<style[^>]*>(.*?)</style>', re.DOTALL | re.IGNORECASE)
+
+
+def extract_stylesheets(apps, schema_editor):
+    'Move the style elements appended to each visualization into a stylesheet shared by the visualizations with the same CSS'
+    HtmlVisualization = apps.get_model('texts', 'HtmlVisualization')
+    VisualizationStylesheet = apps.get_model('texts', 'VisualizationStylesheet')
+    stylesheets = {}
+
+    vis_ids = list(HtmlVisualization.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(vis_ids), BATCH_SIZE):
+        for vis in HtmlVisualization.objects.filter(id__in=vis_ids[start:start + BATCH_SIZE]):
+            css = '\n'.join(STYLE_ELEMENT.findall(vis.html))
+            if not css:
+                continue
+
+            html = STYLE_ELEMENT.sub('', vis.html)
+            key = (vis.visualization_format_id, hashlib.sha1(css.encode('utf-8')).hexdigest())
+            if key not in stylesheets:
+                stylesheets[key] = VisualizationStylesheet.objects.get_or_create(
+                    visualization_format_id=key[0], fingerprint=key[1], defaults={'css': css})[0]
+
+            HtmlVisualization.objects.filter(id=vis.id).update(html=html, stylesheet=stylesheets[key],
+                fingerprint=hashlib.sha1((html + css).encode('utf-8')).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0024_text_is_live'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisualizationStylesheet',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('fingerprint', models.CharField(max_length=40, db_index=True)),
+                ('css', models.TextField()),
+                ('visualization_format', models.ForeignKey(blank=True, to='texts.HtmlVisualizationFormat', null=True)),
+            ],
+            options={
+                'verbose_name': 'Visualization Stylesheet',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='visualizationstylesheet',
+            unique_together=set([('visualization_format', 'fingerprint')]),
+        ),
+        migrations.AddField(
+            model_name='htmlvisualization',
+            name='stylesheet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='texts.VisualizationStylesheet', null=True),
+        ),
+        migrations.RunPython(extract_stylesheets),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import zlib
+from django.db import models, migrations
+
+BATCH_SIZE = 200
+GZIP_WBITS = 31
+
+
+def compress_html(apps, schema_editor):
+    'Store the HTML of each visualization gzip-compressed, a batch at a time'
+    HtmlVisualization = apps.get_model('texts', 'HtmlVisualization')
+
+    vis_ids = list(HtmlVisualization.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(vis_ids), BATCH_SIZE):
+        for vis_id, html in HtmlVisualization.objects.filter(id__in=vis_ids[start:start + BATCH_SIZE]).values_list('id', 'html'):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+            html_gz = compressor.compress(html.encode('utf-8')) + compressor.flush()
+            HtmlVisualization.objects.filter(id=vis_id).update(html_gz=html_gz)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0025_visualizationstylesheet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='htmlvisualization',
+            name='html_gz',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.RunPython(compress_html),
+        migrations.RemoveField(
+            model_name='htmlvisualization',
+            name='html',
+        ),
+    ]
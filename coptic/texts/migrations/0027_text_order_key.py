@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+BATCH_SIZE = 500
+
+
+def set_order_keys(apps, schema_editor):
+    'Set the order key of each text to the value of its order metadata, if it has exactly one, or else its title'
+    Text = apps.get_model('texts', 'Text')
+    TextTextMeta = Text.text_meta.through
+
+    order_values = {}
+    for text_id, value in TextTextMeta.objects.filter(textmeta__name='order').values_list('text_id', 'textmeta__value'):
+        order_values.setdefault(text_id, []).append(value)
+
+    texts = list(Text.objects.order_by('id').values_list('id', 'title'))
+    for start in range(0, len(texts), BATCH_SIZE):
+        for text_id, title in texts[start:start + BATCH_SIZE]:
+            values = order_values.get(text_id, [])
+            Text.objects.filter(id=text_id).update(order_key=(values[0] if len(values) == 1 else title)[:200])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0026_htmlvisualization_html_gz'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='text',
+            name='order_key',
+            field=models.CharField(max_length=200, blank=True, db_index=True, editable=False),
+        ),
+        migrations.RunPython(set_order_keys),
+    ]
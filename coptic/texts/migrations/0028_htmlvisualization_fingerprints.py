@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import zlib
+from django.db import migrations
+
+BATCH_SIZE = 200
+GZIP_WBITS = 31
+
+
+def set_fingerprints(apps, schema_editor):
+    'Set the fingerprint, which is the ETag of the visualization, of each visualization that has none'
+    HtmlVisualization = apps.get_model('texts', 'HtmlVisualization')
+
+    vis_ids = list(HtmlVisualization.objects.filter(fingerprint='').order_by('id').values_list('id', flat=True))
+    for start in range(0, len(vis_ids), BATCH_SIZE):
+        for vis_id, html_gz, css in HtmlVisualization.objects.filter(id__in=vis_ids[start:start + BATCH_SIZE]).values_list(
+                'id', 'html_gz', 'stylesheet__css'):
+            html = zlib.decompress(bytes(html_gz), GZIP_WBITS).decode('utf-8')
+            HtmlVisualization.objects.filter(id=vis_id).update(
+                fingerprint=hashlib.sha1((html + (css or '')).encode('utf-8')).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('texts', '0027_text_order_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_fingerprints),
+    ]
@@ -1,14 +1,23 @@
 import datetime
+import hashlib
 import re
+import zlib
 from base64 import b64encode
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import meta_config
 from .probe_github import github_directory_names
 
+GZIP_WBITS = 31  # zlib wbits for the gzip format, which HTTP clients accept as Content-Encoding: gzip
+
 
 class HtmlVisualizationFormat(models.Model):
 	title = models.CharField(max_length=200)
 	button_title = models.CharField(max_length=200)
 	slug = models.CharField(max_length=200)
+	needs_javascript = models.BooleanField(default=False,
+		help_text='Render with a headless browser instead of fetching the HTML directly')
 
 	class Meta:
 		verbose_name = "HTML Visualization Format"
@@ -17,9 +26,31 @@ class HtmlVisualizationFormat(models.Model):
 		return self.title
 
 
+class VisualizationStylesheet(models.Model):
+	'The CSS of visualizations of a format, stored once however many visualizations use it'
+	visualization_format = models.ForeignKey(HtmlVisualizationFormat, blank=True, null=True)
+	fingerprint = models.CharField(max_length=40, db_index=True)  # SHA-1 of css
+	css = models.TextField()
+
+	class Meta:
+		verbose_name = "Visualization Stylesheet"
+		unique_together = ('visualization_format', 'fingerprint')
+
+	def __str__(self):
+		return self.fingerprint
+
+	@staticmethod
+	def fingerprint_css(css):
+		return hashlib.sha1(css.encode('utf-8')).hexdigest()
+
+
 class HtmlVisualization(models.Model):
 	visualization_format = models.ForeignKey(HtmlVisualizationFormat, blank=True, null=True)
-	html = models.TextField()
+	html_gz = models.BinaryField()  # The HTML, gzip-compressed. Use html.
+	stylesheet = models.ForeignKey(VisualizationStylesheet, blank=True, null=True, on_delete=models.SET_NULL)
+	fingerprint = models.CharField(max_length=40, blank=True)  # SHA-1 of html and the stylesheet's css
+	etag = models.CharField(max_length=200, blank=True)
+	last_modified = models.CharField(max_length=200, blank=True)
 
 	class Meta:
 		verbose_name = "HTML Visualization"
@@ -27,6 +58,29 @@ class HtmlVisualization(models.Model):
 	def __str__(self):
 		return self.visualization_format.title
 
+	@property
+	def html(self):
+		return zlib.decompress(bytes(self.html_gz), GZIP_WBITS).decode('utf-8')
+
+	@html.setter
+	def html(self, html):
+		self.html_gz = gzip_html(html)
+
+	def save(self, *args, **kwargs):
+		''' On save, set the fingerprint if it isn't set, as it is the ETag of the visualization '''
+		if not self.fingerprint:
+			self.fingerprint = self.fingerprint_html(self.html, self.stylesheet.css if self.stylesheet else '')
+		super(HtmlVisualization, self).save(*args, **kwargs)
+
+	@staticmethod
+	def fingerprint_html(html, css):
+		return hashlib.sha1((html + css).encode('utf-8')).hexdigest()
+
+
+def gzip_html(html):
+	compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+	return compressor.compress(html.encode('utf-8')) + compressor.flush()
+
 
 class Corpus(models.Model):
 	created = models.DateTimeField(editable=False)
@@ -44,16 +98,29 @@ class Corpus(models.Model):
 	class Meta:
 		verbose_name_plural = "Corpora"
 
+	def __init__(self, *args, **kwargs):
+		super(Corpus, self).__init__(*args, **kwargs)
+		self._github_source = (self.github, self.annis_corpus_name)
+
 	def __str__(self):
 		return self.title
 
 	def save(self, *args, **kwargs):
-		''' On save, update timestamps '''
+		''' On save, update timestamps, and the GitHub directory names if the repository or ANNIS name changed '''
 		if not self.id:
 			self.created = datetime.datetime.today()
 		self.modified = datetime.datetime.today()
-		self.github_tei, self.github_relannis, self.github_paula = github_directory_names(self)
+		if not self.id or (self.github, self.annis_corpus_name) != self._github_source:
+			self.refresh_github_directory_names()
 		super(Corpus, self).save(*args, **kwargs)
+		self._github_source = (self.github, self.annis_corpus_name)
+
+	def refresh_github_directory_names(self):
+		''' Look up the TEI, ANNIS and PAULA directory names in the cached listing of the GitHub repository.
+		They are left as they are if GitHub can't be reached. '''
+		dir_names = github_directory_names(self)
+		if dir_names is not None:
+			self.github_tei, self.github_relannis, self.github_paula = dir_names
 
 	def _annis_corpus_name_b64encoded(self):
 		return b64encode(str.encode(self.annis_corpus_name)).decode()
@@ -65,13 +132,23 @@ class Corpus(models.Model):
 class TextMeta(models.Model):
 	name  = models.CharField(max_length=200)
 	value = models.CharField(max_length=10000)
+	value_hash = models.CharField(max_length=40, editable=False)  # Indexable stand-in for the long value
 
 	class Meta:
 		verbose_name = "Text Meta Item"
+		unique_together = ('name', 'value_hash')
 
 	def __str__(self):
 		return self.name + ": " + self.value
 
+	def save(self, *args, **kwargs):
+		self.value_hash = TextMeta.hash_value(self.value)
+		return super(TextMeta, self).save(*args, **kwargs)
+
+	@staticmethod
+	def hash_value(value):
+		return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
 	def value_customized(self):
 		v = self.value
 		if re.match(r'https?://', v):  # Turn URLs into <a> tags
@@ -95,6 +172,12 @@ class MetaOrder(models.Model):
 		return self.name
 
 
+class TextQuerySet(models.QuerySet):
+	def live(self):
+		'Texts readers see. An ingest builds new texts alongside them, and swaps them in when finished.'
+		return self.filter(is_live=True)
+
+
 class Text(models.Model):
 	from ingest.models import Ingest
 	title = models.CharField(max_length=200)
@@ -102,11 +185,15 @@ class Text(models.Model):
 	created = models.DateTimeField(editable=False)
 	modified = models.DateTimeField(editable=False)
 	is_expired = models.BooleanField(default=False)
+	is_live = models.BooleanField(default=True, db_index=True)
 	corpus = models.ForeignKey(Corpus, blank=True, null=True)
 	ingest = models.ForeignKey(Ingest, blank=True, null=True)
 	html_visualizations = models.ManyToManyField(HtmlVisualization, blank=True)
 	text_meta = models.ManyToManyField(TextMeta, blank=True)
+	fingerprint = models.CharField(max_length=40, blank=True, editable=False)  # SHA-1 of the ANNIS metadata
+	order_key = models.CharField(max_length=200, blank=True, db_index=True, editable=False)  # Texts of a corpus are listed in this order
 
+	objects = TextQuerySet.as_manager()
 
 	def __str__(self):
 		return self.title
@@ -116,8 +203,15 @@ class Text(models.Model):
 		if not self.id:
 			self.created = datetime.datetime.today()
 		self.modified = datetime.datetime.today()
+		if not self.order_key:
+			self.order_key = Text.make_order_key(self.title, [])
 		return super(Text, self).save(*args, **kwargs)
 
+	@staticmethod
+	def make_order_key(title, order_values):
+		'The value of the order metadata, if the text has exactly one, or else the title'
+		return (order_values[0] if len(order_values) == 1 else title)[:200]
+
 
 class SpecialMeta(models.Model):
 	'Metadata names that are used as “search” buttons and that may have multiple values splittable by comma'
@@ -130,3 +224,10 @@ class SpecialMeta(models.Model):
 
 	def __str__(self):
 		return self.name
+
+
+@receiver([post_save, post_delete], sender=MetaOrder)
+@receiver([post_save, post_delete], sender=SpecialMeta)
+def invalidate_meta_config(sender, **kwargs):
+	'Make every process reload its copies of MetaOrder and SpecialMeta'
+	meta_config.invalidate()
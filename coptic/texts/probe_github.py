@@ -1,20 +1,29 @@
-import requests
-import json
+'''Find the TEI, ANNIS and PAULA directories of corpora in the CopticScriptorium corpora repository on GitHub,
+from one listing of the repository tree shared by all corpora and kept in the Django cache'''
 
+import logging
+import requests
+from django.conf import settings
+from django.core.cache import cache
 
-def github_directory_names(corpus):
-	'Return a sequence of directory names or blanks'
+logger = logging.getLogger(__name__)
+TREE_URL = 'https://api.github.com/repos/CopticScriptorium/corpora/git/trees/master?recursive=1'
+CACHE_KEY = 'probe_github.subdirectories'
+STALE_CACHE_KEY = CACHE_KEY + '.stale'  # Kept indefinitely, for when GitHub can't be reached
+FAILED_CACHE_KEY = CACHE_KEY + '.failed'
+RETRY_SECONDS = 5 * 60
 
-	# Get the Github API URL for the contents of the corpus page
-	url = 'https://api.github.com/repos/CopticScriptorium/corpora/contents/' + corpus.github.split('/')[-1]
-	resp = requests.get(url)
 
-	# Decode the JSON into a list of items (files, directories, etc.)
-	dir_contents_list = json.loads(resp.text)
+def github_directory_names(corpus):
+	'''Return a sequence of directory names or blanks. Return None if GitHub can't be reached and the
+	repository has never been listed.'''
+	subdirectories = repository_subdirectories()
+	if subdirectories is None:
+		return None
 
 	# Extract directory names for this corpus
-	dir_names = [item['name'] for item in dir_contents_list if item['type'] == 'dir' and item['name'].
-		startswith(corpus.annis_corpus_name)]
+	dir_names = [dir_name for dir_name in subdirectories.get(corpus.github.split('/')[-1], [])
+		if dir_name.startswith(corpus.annis_corpus_name)]
 
 	def dir_name_or_blank(category):
 		'Search the directory names for one of TEI, etc., and return that name, or an empty string.'
@@ -22,6 +31,46 @@ def github_directory_names(corpus):
 		return matches[0] if matches else ''
 
 	# Get the directory name or '' for each of the categories
-	ordered_dir_names = tuple((dir_name_or_blank(category) for category in ('TEI', 'ANNIS', 'PAULA')))
+	return tuple(dir_name_or_blank(category) for category in ('TEI', 'ANNIS', 'PAULA'))
+
+
+def repository_subdirectories():
+	'''The names of the directories in each top-level directory of the repository, by top-level directory.
+	Listed at most once every GITHUB_TREE_CACHE_SECONDS. If the listing fails, the last one is used.'''
+	subdirectories = cache.get(CACHE_KEY)
+	if subdirectories is not None:
+		return subdirectories
+	if cache.get(FAILED_CACHE_KEY):
+		return cache.get(STALE_CACHE_KEY)
+
+	try:
+		subdirectories = _list_subdirectories()
+	except (requests.RequestException, ValueError, KeyError) as e:
+		logger.warning('Unable to list the corpora repository on GitHub: %s' % e)
+		cache.set(FAILED_CACHE_KEY, True, RETRY_SECONDS)
+		return cache.get(STALE_CACHE_KEY)
+
+	cache.set(CACHE_KEY, subdirectories, getattr(settings, 'GITHUB_TREE_CACHE_SECONDS', 24 * 60 * 60))
+	cache.set(STALE_CACHE_KEY, subdirectories, None)
+	return subdirectories
+
+
+def clear_cache():
+	'Make the next lookup list the repository again'
+	cache.delete_many([CACHE_KEY, FAILED_CACHE_KEY])
+
+
+def _list_subdirectories():
+	resp = requests.get(TREE_URL, timeout=30)
+	resp.raise_for_status()
+	tree = resp.json()
+	if tree.get('truncated'):
+		# Directories missing from a partial listing would be blanked on the corpora
+		raise ValueError('GitHub truncated the listing of the corpora repository')
 
-	return ordered_dir_names
+	subdirectories = {}
+	for item in tree['tree']:
+		parts = item['path'].split('/')
+		if item['type'] == 'tree' and len(parts) == 2:
+			subdirectories.setdefault(parts[0], []).append(parts[1])
+	return subdirectories
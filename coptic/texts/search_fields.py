@@ -1,4 +1,5 @@
-from texts.models import SpecialMeta, TextMeta
+from texts.meta_config import special_metas
+from texts.models import TextMeta
 
 
 class SearchField:
@@ -11,14 +12,14 @@ class SearchField:
 					yield part.strip()
 
 		self.title = title
-		pre_split_values = TextMeta.objects.filter(name=title).values_list('value', flat=True).distinct().order_by('value')
+		pre_split_values = TextMeta.objects.filter(name=title, text__is_live=True).values_list('value', flat=True).distinct().order_by('value')
 		self.values = sorted(set(get_parts(pre_split_values))) if splittable else pre_split_values
 
 
 def get_search_fields():
 	'Get the search fields for the search tools in the site header. Sort using the order from SpecialMeta.'
 
-	all_sm = SpecialMeta.objects.all()
+	all_sm = special_metas()
 	splittable = [sm.name for sm in all_sm if sm.splittable]
 	order_by_name = {sm.name: sm.order for sm in all_sm}
 
@@ -1,7 +1,58 @@
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.test.utils import override_settings
+from texts import meta_config
+from texts.models import MetaOrder, SpecialMeta
 
 class TextViewsTestCase(TestCase):
 	def test_text_view(self):
 		print(" -- testing the text views")
 		resp = self.client.get("/texts/ya421-428/")
-		self.assertEqual(resp.status_code, 200)
\ No newline at end of file
+		self.assertEqual(resp.status_code, 200)
+
+# The cache the site is deployed with, whose reads are database queries
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'django_cache'}})
+class MetaConfigTestCase(TestCase):
+	@classmethod
+	def setUpClass(cls):
+		super(MetaConfigTestCase, cls).setUpClass()
+		call_command('createcachetable')
+
+	def tearDown(self):
+		meta_config.invalidate()  # The rows are rolled back without signals
+
+	def test_meta_config_invalidated_on_save(self):
+		print(" -- testing the cache of metadata order and special metadata")
+		meta_order = MetaOrder.objects.create(name='author', order=1)
+		# The version stamp, then the two tables
+		with self.assertNumQueries(3):
+			self.assertEqual(meta_config.meta_orders(), {'author': 1})
+		with self.assertNumQueries(0):
+			self.assertEqual(meta_config.meta_orders(), {'author': 1})
+
+		meta_order.order = 2
+		meta_order.save()
+		self.assertEqual(meta_config.meta_orders(), {'author': 2})
+		SpecialMeta.objects.create(name='author', order=1)
+		self.assertEqual([sm.name for sm in meta_config.special_metas()], ['author'])
+
+		meta_order.delete()
+		self.assertEqual(meta_config.meta_orders(), {})
+
+	@override_settings(META_CONFIG_CHECK_SECONDS=5)
+	def test_meta_config_changed_by_another_process(self):
+		print(" -- testing the version stamp of metadata order and special metadata")
+		MetaOrder.objects.create(name='author', order=1)
+		now = meta_config.time()
+		with mock.patch('texts.meta_config.time', lambda: now):
+			self.assertEqual(meta_config.meta_orders(), {'author': 1})
+
+			# Another process changes the order, which this one sees once it checks the stamp again
+			MetaOrder.objects.filter(name='author').update(order=2)
+			cache.set(meta_config.VERSION_CACHE_KEY, 'changed', None)
+			with self.assertNumQueries(0):
+				self.assertEqual(meta_config.meta_orders(), {'author': 1})
+		with mock.patch('texts.meta_config.time', lambda: now + 5):
+			self.assertEqual(meta_config.meta_orders(), {'author': 2})